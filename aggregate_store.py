@@ -0,0 +1,143 @@
+import logging
+import numpy
+import os
+import pandas
+import pickle
+from config import AGGREGATES_PATH
+from util import atomic_write, mdbstr_to_time, time_to_fsstr
+
+
+ROLLING_DTYPE = numpy.dtype([("idCity", "i4"), ("rm3", "f4"), ("rm7", "f4")])
+WINDOW_SIZE = 7
+_BASELINE_COLUMNS = {"country": "idCountry", "state": "idState", "city": "idCity"}
+
+
+class AggregateStore(object):
+    # materialized aggregates of covid_cases_history, updated incrementally with every ingested batch:
+    #  - the last WINDOW_SIZE daily growths of each city, from which the 3 and 7 day rolling means of every entrance
+    #    date are written to <path>/rolling/<YYYY-MM-DD>/<datetime>.npy
+    #  - the daily growth totals by state and by country, one row per entrance date
+    #  - the cumulative cases by country, state and city of the baseline file, the first one ingested, which only sets
+    #    the starting point of the daily growths and never reaches covid_cases_history
+
+    def __init__(self, path: str = None):
+        self._path: str = path if path else AGGREGATES_PATH
+        self._state: dict = None
+
+    def update(self, batch: pandas.DataFrame, replaces: str = None):
+        # `batch` holds the GROWTH_COLUMNS of a single entrance date. When it is a same day update, `replaces` is the
+        #  entrance date whose values it overwrites.
+        if batch.empty:
+            return
+        state = self._load()
+        entrance_date = batch["entranceDate"].iloc[0]
+        growth = batch.set_index("idCity")["dailyCasesGrowth"].astype("float64")
+        window = state["window"]
+        if replaces and replaces == state["last_entrance_date"]:
+            window = window.drop(columns=window.columns[-1])
+            for totals in ("state_totals", "country_totals"):
+                state[totals] = state[totals].drop(index=replaces, errors="ignore")
+        elif replaces:
+            logging.warning(f"Aggregates are not at entrance date {replaces}; appending {entrance_date} instead.")
+        window = pandas.concat([window, growth.rename(entrance_date)], axis=1, sort=False).iloc[:, -WINDOW_SIZE:]
+        state["window"] = window
+        state["last_entrance_date"] = entrance_date
+        state["state_totals"] = _append_totals(state["state_totals"], batch, "idState", entrance_date)
+        state["country_totals"] = _append_totals(state["country_totals"], batch, "idCountry", entrance_date)
+        rolling = numpy.zeros(len(growth), dtype=ROLLING_DTYPE)
+        rolling["idCity"] = growth.index.values
+        rolling["rm3"] = window.loc[growth.index].iloc[:, -3:].mean(axis=1).values
+        rolling["rm7"] = window.loc[growth.index].mean(axis=1).values
+        self._save_rolling(entrance_date, rolling)
+        self._save()
+
+    def rolling(self, entrance_date: str) -> pandas.DataFrame:
+        # rm3 and rm7 by idCity at the given entrance date, or None if it was never aggregated
+        filename = self._rolling_filename(entrance_date)
+        if not os.path.exists(filename):
+            return None
+        return pandas.DataFrame(numpy.load(filename, mmap_mode="r")).set_index("idCity")
+
+    def first_entrance_date(self) -> str:
+        totals = self._load()["country_totals"]
+        return totals.index[0] if not totals.empty else None
+
+    def last_entrance_date(self) -> str:
+        return self._load()["last_entrance_date"]
+
+    def state_totals(self) -> pandas.DataFrame:
+        return self._load()["state_totals"]
+
+    def country_totals(self) -> pandas.DataFrame:
+        return self._load()["country_totals"]
+
+    def region_series(self, level: str) -> pandas.DataFrame:
+        # the "state" or "country" totals as (idRegion, entranceDate, cases) rows ordered by region and date, or None
+        #  when nothing was aggregated yet
+        totals = self.state_totals() if level == "state" else self.country_totals()
+        if totals.empty:
+            return None
+        series = totals.rename_axis(index="entranceDate", columns="idRegion").T.stack().rename("cases").reset_index()
+        series["entranceDate"] = pandas.to_datetime(series["entranceDate"])
+        return series.sort_values(["idRegion", "entranceDate"]).reset_index(drop=True)
+
+    def set_baseline(self, data: numpy.ndarray):
+        # `data` is the CASES_DTYPE snapshot of the baseline file
+        frame = pandas.DataFrame(data).drop_duplicates("idCity", keep="last")
+        self._load()["baseline"] = {level: {int(k): int(v) for k, v in frame.groupby(column)["cases"].sum().items()}
+                                    for level, column in _BASELINE_COLUMNS.items()}
+        self._save()
+
+    def baseline(self, level: str) -> dict:
+        # idRegion -> cumulative cases of the baseline file, empty when it was never recorded
+        return self._load().get("baseline", {}).get(level, {})
+
+    def reset(self):
+        self._state = _empty_state()
+        self._save()
+
+    def rebuild(self, history: pandas.DataFrame):
+        # `history` holds GROWTH_COLUMNS for any number of entrance dates, e.g. the whole covid_cases_history table.
+        #  The baseline is not part of the history and is kept.
+        baseline = self._load().get("baseline", {})
+        self.reset()
+        self._state["baseline"] = baseline
+        for _, batch in history.groupby("entranceDate", sort=True):
+            self.update(batch)
+
+    def _load(self) -> dict:
+        if self._state is None:
+            try:
+                with open(os.path.join(self._path, "state.pickle"), "rb") as f:
+                    self._state = pickle.load(f)
+            except (OSError, EOFError, pickle.UnpicklingError):
+                self._state = _empty_state()
+        return self._state
+
+    def _save(self):
+        atomic_write(os.path.join(self._path, "state.pickle"),
+                     lambda f: pickle.dump(self._state, f, protocol=pickle.HIGHEST_PROTOCOL))
+
+    def _save_rolling(self, entrance_date: str, rolling: numpy.ndarray):
+        atomic_write(self._rolling_filename(entrance_date), lambda f: numpy.save(f, rolling))
+
+    def _rolling_filename(self, entrance_date: str) -> str:
+        entrance_datetime = mdbstr_to_time(entrance_date)
+        return os.path.join(self._path, "rolling", entrance_datetime.strftime("%Y-%m-%d"),
+                            f"{time_to_fsstr(entrance_datetime)}.npy")
+
+
+def _empty_state() -> dict:
+    return {
+        "last_entrance_date": None,
+        "window": pandas.DataFrame(),
+        "state_totals": pandas.DataFrame(),
+        "country_totals": pandas.DataFrame(),
+        "baseline": {}
+    }
+
+
+def _append_totals(totals: pandas.DataFrame, batch: pandas.DataFrame, key: str,
+                   entrance_date: str) -> pandas.DataFrame:
+    row = batch.groupby(key)["dailyCasesGrowth"].sum().rename(entrance_date).to_frame().T
+    return pandas.concat([totals, row], sort=False).fillna(0).astype("int64").sort_index()
@@ -0,0 +1,223 @@
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from config import LOG_LEVEL
+
+
+logging.basicConfig(level=LOG_LEVEL)
+
+
+def _timeit(func, repeat: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _synthetic_states_and_cities(states: int = 27, cities: int = 5570, seed: int = 7):
+    import geopandas as gpd
+    import numpy
+    from shapely.geometry import box
+    # a grid of square "states" covering roughly the bounding box of Brazil and uniformly scattered "cities" over it
+    columns = 6
+    rows = -(-states // columns)
+    width, height = 40 / columns, 40 / rows
+    polygons = [box(-74 + (i % columns) * width, -34 + (i // columns) * height,
+                    -74 + (i % columns + 1) * width, -34 + (i // columns + 1) * height) for i in range(states)]
+    states_shape = gpd.GeoDataFrame({"CD_GEOCUF": [str(11 + i) for i in range(states)]}, geometry=polygons)
+    rnd = numpy.random.RandomState(seed)
+    xs = rnd.uniform(-74, -34, cities)
+    ys = rnd.uniform(-34, -34 + rows * height, cities)
+    points = gpd.GeoDataFrame({"cases": rnd.randint(0, 100, cities)}, geometry=gpd.points_from_xy(xs, ys))
+    return states_shape, points
+
+
+def bench_spatial_filter():
+    import pandas
+    from plot_handler import assign_states
+    states_shape, points = _synthetic_states_and_cities()
+
+    def naive():
+        for _, state in states_shape.iterrows():
+            state_filter = pandas.Series(map(lambda e: state["geometry"].contains(e[1]["geometry"]), points.iterrows()),
+                                         points.index)
+            points[state_filter]
+
+    def indexed():
+        state_idx = assign_states(points, states_shape)
+        groups = state_idx.groupby(state_idx).groups
+        for idx in states_shape.index:
+            points.loc[groups.get(idx, [])]
+
+    naive_time, indexed_time = _timeit(naive, repeat=1), _timeit(indexed)
+    logging.info(f"spatial_filter: per-state contains loop {naive_time:.3f}s, spatial join + group by "
+                 f"{indexed_time:.3f}s ({naive_time / indexed_time:.1f}x)")
+
+
+def _synthetic_snapshots(files: int = 60, cities: int = 5570, seed: int = 7) -> list:
+    import numpy
+    from fs_handler import CASES_DTYPE
+    rnd = numpy.random.RandomState(seed)
+    cases = numpy.zeros(cities, dtype="i4")
+    snapshots = []
+    for i in range(files):
+        cases = cases + rnd.randint(0, 20, cities).astype("i4")
+        data = numpy.zeros(cities, dtype=CASES_DTYPE)
+        data["idCountry"], data["idState"], data["idCity"], data["cases"] = 1, numpy.arange(cities) % 27 + 1, \
+            numpy.arange(cities) + 1, cases
+        snapshots.append((f"2020-06-{i % 28 + 1:02d} 22:00:00", data))
+    return snapshots
+
+
+def bench_daily_growth():
+    from cases_diff import compute_daily_growth
+    snapshots = _synthetic_snapshots()
+
+    def dict_loop():
+        cur_data = {}
+        for entrance_date, new_data in snapshots:
+            db_data = []
+            for id_country, id_state, id_city, cases in new_data.tolist():
+                if id_city not in cur_data:
+                    cur_data[id_city] = {"idCountry": id_country, "idState": id_state, "idCity": id_city,
+                                         "cases": cases, "entranceDate": entrance_date}
+                    continue
+                cur_data[id_city]["dailyCasesGrowth"] = cases - cur_data[id_city]["cases"]
+                cur_data[id_city]["cases"] = cases
+                cur_data[id_city]["entranceDate"] = entrance_date
+                db_data.append(cur_data[id_city].copy())
+
+    loop_time, vectorized_time = _timeit(dict_loop), _timeit(lambda: compute_daily_growth(snapshots))
+    logging.info(f"daily_growth: dict loop {loop_time:.3f}s, vectorized diff {vectorized_time:.3f}s "
+                 f"({loop_time / vectorized_time:.1f}x) over {len(snapshots)} files")
+
+
+def _synthetic_zip(path: str, cities: int = 5570, seed: int = 7) -> str:
+    import numpy
+    from zipfile import ZIP_DEFLATED, ZipFile
+    from config import CSV_FILENAME
+    rnd = numpy.random.RandomState(seed)
+    lines = ['"idCountry","idState","idCity","confirmed","lastUpdate"']
+    lines.extend(f'1,{i % 27 + 1},{i + 1},{cases},"2020-06-01 22:00:00"'
+                 for i, cases in enumerate(rnd.randint(0, 10000, cities)))
+    zip_filename = os.path.join(path, "csv_dados_01_06_2020-22_00_00.zip")
+    with ZipFile(zip_filename, "w", ZIP_DEFLATED) as zip_obj:
+        zip_obj.writestr(CSV_FILENAME, "\n".join(lines) + "\n")
+    return zip_filename
+
+
+def bench_csv_parse():
+    from fs_handler import get_data_from_csv
+    with tempfile.TemporaryDirectory() as path:
+        zip_filename = _synthetic_zip(path)
+        parse_time = _timeit(lambda: get_data_from_csv(zip_filename))
+    logging.info(f"csv_parse: {parse_time:.3f}s per file")
+
+
+class _FakeCursor(object):
+    # stands in for a MariaDB cursor so that the client side cost of each write path (building the statements and
+    #  serializing the rows) is measured without a server
+    rowcount = 0
+
+    def execute(self, statement, data=None):
+        if data and statement.lstrip().startswith("LOAD DATA"):
+            with open(data[0]) as f:
+                f.read()
+
+    def executemany(self, statement, data):
+        pass
+
+    def close(self):
+        pass
+
+
+class _FakeConnection(object):
+    def cursor(self):
+        return _FakeCursor()
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+    def is_connected(self):
+        return True
+
+
+def bench_db_write():
+    from cases_diff import compute_daily_growth
+    from config import DATABASE
+    from mariadb_handler import INSERT_MODES, MariaDBHandler
+    # the fake connection never reaches a server, so the load_data path can be measured safely
+    DATABASE["allow_local_infile"] = True
+    batch = compute_daily_growth(_synthetic_snapshots(files=2))[-1]
+    db_handler = MariaDBHandler("localhost", "covid", "user", "password", connection_factory=_FakeConnection)
+    for mode in INSERT_MODES:
+        insert_time = _timeit(lambda: db_handler.batch_insert(batch, mode=mode))
+        logging.info(f"db_write: insert '{mode}' {insert_time:.3f}s for {len(batch)} rows")
+    batch = batch.assign(entranceDateToUpdate=batch["entranceDate"])
+    for mode in ["executemany", "multirow"]:
+        update_time = _timeit(lambda: db_handler.batch_update(batch, mode=mode))
+        logging.info(f"db_write: update '{mode}' {update_time:.3f}s for {len(batch)} rows")
+    db_handler.close()
+
+
+def bench_shapefile():
+    import shape_cache
+    from config import PLOT
+    states_shape, _ = _synthetic_states_and_cities()
+    with tempfile.TemporaryDirectory() as path:
+        shape_file = os.path.join(path, "states.shp")
+        states_shape.to_file(shape_file)
+        PLOT["shape_cache_path"] = os.path.join(path, "cache")
+        parse_time = _timeit(lambda: shape_cache.rebuild_shapes([shape_file]))
+
+        def cached_load():
+            # the in-process LRU is cleared so that the pickle is what gets loaded
+            shape_cache._load_shape.cache_clear()
+            shape_cache.load_shape(shape_file)
+
+        load_time = _timeit(cached_load)
+    logging.info(f"shapefile: parse {parse_time:.3f}s, cached load {load_time:.3f}s "
+                 f"({parse_time / load_time:.1f}x)")
+
+
+def bench_imports():
+    # import time of each entry point measured in a fresh interpreter, so that nothing is already cached in sys.modules
+    for module in ["cli", "main", "mariadb_handler", "plot_handler", "lstm_cases_prediction"]:
+        def run():
+            subprocess.run([sys.executable, "-c", f"import {module}"], check=True, stderr=subprocess.DEVNULL)
+        try:
+            logging.info(f"imports: {module} {_timeit(run):.3f}s")
+        except subprocess.CalledProcessError:
+            logging.warning(f"imports: {module} could not be imported in this environment.")
+
+
+BENCHMARKS = {
+    "spatial_filter": bench_spatial_filter,
+    "daily_growth": bench_daily_growth,
+    "csv_parse": bench_csv_parse,
+    "db_write": bench_db_write,
+    "shapefile": bench_shapefile,
+    "imports": bench_imports
+}
+
+
+if __name__ == "__main__":
+    import instrumentation
+    for name in sys.argv[1:] or BENCHMARKS.keys():
+        try:
+            BENCHMARKS[name]()
+        except ImportError as error:
+            logging.warning(f"{name}: skipped, {error}.")
+    # per span totals (calls, seconds, rows per second) accumulated by the instrumented code paths while benchmarking
+    print(instrumentation.to_json())
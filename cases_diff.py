@@ -0,0 +1,70 @@
+import numpy
+import pandas
+from instrumentation import timed
+
+
+GROWTH_COLUMNS = ["idCountry", "idState", "idCity", "dailyCasesGrowth", "entranceDate"]
+
+
+def snapshot_frame(data: numpy.ndarray) -> pandas.DataFrame:
+    # a snapshot is a CASES_DTYPE array read from one ZIP file; it becomes a frame indexed by idCity
+    return pandas.DataFrame(data).drop_duplicates("idCity", keep="last").set_index("idCity")
+
+
+@timed("daily_growth", rows=lambda batches: sum(len(b) for b in batches))
+def compute_daily_growth(snapshots: list) -> list:
+    # `snapshots` is a list of (entranceDate, CASES_DTYPE array) tuples ordered from the oldest to the newest. For each
+    #  snapshot a columnar batch with GROWTH_COLUMNS is returned holding, for every city present in it, the difference
+    #  to the latest previous snapshot in which the city appeared. Cities seen for the first time only set the baseline,
+    #  hence the batch of the first snapshot is always empty.
+    if not snapshots:
+        return []
+    data = numpy.concatenate([d for _, d in snapshots])
+    snapshot_idx = numpy.repeat(numpy.arange(len(snapshots)), [d.size for _, d in snapshots])
+    # the first occurrence of a city gives its idCountry and idState; later duplicates overwrite its cases
+    cities, first_idx, city_idx = numpy.unique(data["idCity"], return_index=True, return_inverse=True)
+    # cities x snapshots matrix of cases with NaN where a city is missing from a snapshot
+    cases = numpy.full((cities.size, len(snapshots)), numpy.nan)
+    cases[city_idx, snapshot_idx] = data["cases"]
+    # the previous known cases of each cell: forward fill along the snapshots axis, then shift it by one snapshot
+    last_seen = numpy.where(numpy.isnan(cases), 0, numpy.arange(len(snapshots)))
+    filled = cases[numpy.arange(cities.size)[:, None], numpy.maximum.accumulate(last_seen, axis=1)]
+    previous = numpy.full_like(cases, numpy.nan)
+    previous[:, 1:] = filled[:, :-1]
+    growth = cases - previous
+    id_country, id_state = data["idCountry"][first_idx], data["idState"][first_idx]
+    batches = []
+    for i, (entrance_date, _) in enumerate(snapshots):
+        present = ~numpy.isnan(growth[:, i])
+        batches.append(pandas.DataFrame({
+            "idCountry": id_country[present],
+            "idState": id_state[present],
+            "idCity": cities[present],
+            "dailyCasesGrowth": growth[present, i].astype("int64"),
+            "entranceDate": entrance_date
+        }, columns=GROWTH_COLUMNS))
+    return batches
+
+
+class DailyGrowthReducer(object):
+    # incremental counterpart of compute_daily_growth: snapshots are fed one at a time, oldest first, and the reducer
+    #  keeps the latest known cases of every city to diff the next snapshot against
+
+    def __init__(self):
+        self._cases: pandas.Series = pandas.Series(dtype="float64")
+        self._ids: pandas.DataFrame = pandas.DataFrame(columns=["idCountry", "idState"])
+
+    @timed("daily_growth", rows=len)
+    def reduce(self, entrance_date: str, data: numpy.ndarray) -> pandas.DataFrame:
+        frame = snapshot_frame(data)
+        city_growth = (frame["cases"] - self._cases.reindex(frame.index)).dropna()
+        self._cases = frame["cases"].combine_first(self._cases)
+        self._ids = self._ids.combine_first(frame[["idCountry", "idState"]])
+        city_ids = self._ids.loc[city_growth.index]
+        return pandas.DataFrame({
+            "idCountry": city_ids["idCountry"].values.astype("int64"),
+            "idState": city_ids["idState"].values.astype("int64"),
+            "idCity": city_growth.index.values,
+            "dailyCasesGrowth": city_growth.values.astype("int64"),
+            "entranceDate": entrance_date
+        }, columns=GROWTH_COLUMNS)
@@ -0,0 +1,42 @@
+import geopandas as gpd
+import logging
+import numpy
+import os
+import pandas
+from config import PLOT
+from mariadb_handler import MariaDBHandler
+from util import atomic_write
+
+CITIES_DTYPE = numpy.dtype([("idCity", "i4"), ("idCountry", "i4"), ("idState", "i4"), ("latitude", "f8"),
+                            ("longitude", "f8")])
+
+
+class CityCache(object):
+    # the cities table is static, so it is fetched once into a memory mapped .npy file and its point geometries are
+    #  built once per process with the vectorized points_from_xy
+
+    def __init__(self, db_handler: MariaDBHandler, filename: str = None):
+        self._db_handler: MariaDBHandler = db_handler
+        self._filename: str = filename if filename else PLOT.get("cities_cache_file")
+        self._cities: gpd.GeoDataFrame = None
+
+    def cities(self) -> gpd.GeoDataFrame:
+        # GeoDataFrame indexed by idCity holding idCountry, idState and the city point geometry
+        if self._cities is None:
+            if not os.path.exists(self._filename):
+                self.rebuild()
+            data = numpy.load(self._filename, mmap_mode="r")
+            self._cities = gpd.GeoDataFrame(
+                {"idCountry": data["idCountry"], "idState": data["idState"]},
+                index=pandas.Index(data["idCity"], name="idCity"),
+                geometry=gpd.points_from_xy(data["longitude"], data["latitude"]))
+        return self._cities
+
+    def rebuild(self):
+        df = self._db_handler.get_cities()
+        data = numpy.zeros(len(df), dtype=CITIES_DTYPE)
+        for name in CITIES_DTYPE.names:
+            data[name] = df[name].values
+        atomic_write(self._filename, lambda f: numpy.save(f, data))
+        self._cities = None
+        logging.info(f"Cached {data.size} cities to {self._filename}.")
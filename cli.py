@@ -0,0 +1,134 @@
+import argparse
+import logging
+import os
+from config import LOG_LEVEL, PREDICTION
+from instrumentation import export
+from datetime import datetime, timedelta
+from util import time_to_mdbstr
+
+# only light modules are imported at the top: geopandas/matplotlib (plot), keras/sklearn (predict) and the numpy/pandas
+#  ingest engines are imported inside the subcommands that need them, once it is known there is work to do
+
+
+def _db_args() -> dict:
+    return {"host": os.environ.get("DB_HOST", "localhost"), "database": os.environ.get("DB_NAME", "covid"),
+            "user": os.environ.get("DB_USER", "root"), "password": os.environ.get("DB_PASS", "root")}
+
+
+def _ingest(args):
+    from main import files_to_ingest, ingest, rebuild_aggregates
+    from mariadb_handler import MariaDBHandler
+    dbh = MariaDBHandler(**_db_args())
+    try:
+        if args.rebuild_aggregates:
+            rebuild_aggregates(dbh)
+            return
+        # the entrance dates are looked up once and shared by the file selection and the ingestion
+        entrance_dates = dbh.get_latest_and_previous_entrance_date()
+        fs_handler = files_to_ingest(dbh, args.from_snapshots, entrance_dates)
+        if not fs_handler.get_files_to_process():
+            logging.info("No new CSV file to ingest.")
+            return
+        ingest(dbh, pipelined=False if args.sequential else None, from_snapshots=args.from_snapshots,
+               fs_handler=fs_handler, entrance_dates=entrance_dates)
+        logging.info(f"Database connection pool: {dbh.pool_stats()}")
+    finally:
+        dbh.close()
+
+
+def _plot(args):
+    from fs_handler import images_rendered
+    from mariadb_handler import MariaDBHandler
+    dbh = MariaDBHandler(**_db_args())
+    if not args.backfill:
+        ed = dbh.get_latest_and_previous_entrance_date()[1]
+        if not ed:
+            logging.info("Database appears to be empty. No 'entranceDate' retrieved.")
+            return
+        if not args.force and not args.rebuild_cache and images_rendered(time_to_mdbstr(ed)):
+            logging.info(f"The images of the latest entrance date ({time_to_mdbstr(ed)}) are up to date.")
+            return
+    from city_cache import CityCache
+    from plot_handler import ImageRenderer, PlotHandler, rebuild_shape_cache
+    if args.rebuild_cache:
+        rebuild_shape_cache()
+        CityCache(dbh).rebuild()
+    with ImageRenderer(args.workers) as renderer:
+        plh = PlotHandler(db_handler=dbh, renderer=renderer)
+        if args.backfill:
+            plh.backfill(args.start, args.end + timedelta(days=1) if args.end else None, args.force)
+        else:
+            plh.save_images(time_to_mdbstr(ed), args.force)
+
+
+def _predict(args):
+    from lstm_dao import LstmDao
+    dbh = LstmDao(**_db_args())
+    # predictions based on covid_cases_history are skipped when they already cover its latest entrance date; the
+    #  country model fed from an external source relies on the series fingerprint instead
+    if not args.force and (args.level != "country" or PREDICTION.get("source") == "database"):
+        ed = dbh.get_latest_and_previous_entrance_date()[1]
+        if not ed or ed == dbh.get_latest_prediction_entrance_date(args.level):
+            logging.info(f"No new data since the latest {args.level} prediction.")
+            return
+    if args.level == "country":
+        from lstm_cases_prediction import predict
+        predict(dbh, args.force)
+    else:
+        from lstm_training import train_regions
+        train_regions(dbh, args.level, args.workers)
+
+
+def _add_plot_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--rebuild-cache", action="store_true",
+                        help="re-parse the shapefiles and reload the cities into the caches")
+    parser.add_argument("--workers", type=int, help="number of render processes (defaults to the number of cores)")
+    parser.add_argument("--start", type=lambda e: datetime.strptime(e, "%Y-%m-%d"),
+                        help="first day (YYYY-MM-DD) to backfill")
+    parser.add_argument("--end", type=lambda e: datetime.strptime(e, "%Y-%m-%d"),
+                        help="last day (YYYY-MM-DD, inclusive) to backfill")
+    parser.add_argument("--force", action="store_true", help="render also the dates whose images are up to date")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="COVID-19 cases by day jobs.")
+    parser.add_argument("--metrics", help="write the timing spans, rows per second and peak RSS of the run to this "
+                                          "file, in Prometheus text format if it ends with .prom or JSON otherwise")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+    ingest_parser = subparsers.add_parser("ingest", help="ingest the CSV files into covid_cases_history")
+    ingest_parser.add_argument("--from-snapshots", action="store_true",
+                               help="read the parsed snapshots store instead of the ZIP archive")
+    ingest_parser.add_argument("--rebuild-aggregates", action="store_true",
+                               help="recompute the rolling means and totals store from covid_cases_history and exit")
+    ingest_parser.add_argument("--sequential", action="store_true", help="do not pipeline decoding and writing")
+    ingest_parser.set_defaults(func=_ingest)
+    plot_parser = subparsers.add_parser("plot", help="render the maps of the latest entrance date")
+    _add_plot_arguments(plot_parser)
+    plot_parser.add_argument("--backfill", action="store_true",
+                             help="render every entrance date whose images are missing or outdated")
+    plot_parser.set_defaults(func=_plot)
+    backfill_parser = subparsers.add_parser("backfill", help="render every entrance date whose images are missing")
+    _add_plot_arguments(backfill_parser)
+    backfill_parser.set_defaults(func=_plot, backfill=True)
+    predict_parser = subparsers.add_parser("predict", help="predict the cases of the coming days")
+    predict_parser.add_argument("--level", choices=["country", "state", "city"], default="country")
+    predict_parser.add_argument("--workers", type=int,
+                                help="number of training processes (defaults to the number of cores)")
+    predict_parser.add_argument("--force", action="store_true", help="predict even if there is no new data")
+    predict_parser.set_defaults(func=_predict)
+    return parser
+
+
+def main(argv: list = None):
+    logging.basicConfig(level=LOG_LEVEL)
+    args = build_parser().parse_args(argv)
+    try:
+        args.func(args)
+    finally:
+        if args.metrics:
+            export(args.metrics)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,68 @@
 import logging
 
+AGGREGATES_PATH = "cache/aggregates"
 CSV_FILENAME = "covid_cases_by_city.csv"
 CSV_FILES_PATH = "/home/bruno/CloudStorage/GitHub/Midev/web/rsync-var-www-html/var/www/html/repository/db/csvs/"
+CSV_MANIFEST_PATH = "cache"
 DATETIME_PATTERN = "%d_%m_%Y-%H_%M_%S"
 MARIADB_DATETIME_PATTERN = "%Y-%m-%d %H:%M:%S"
+SNAPSHOTS_PATH = "cache/snapshots"
 ZIP_FILENAME_PATTERN = "csv_dados_(.._.._20..-.._.._..)\.zip"
 LOG_LEVEL = logging.DEBUG
+DATABASE = {
+    "pool_size": 4,
+    "pool_timeout": 30,
+    # one of "executemany", "multirow" or "load_data" (LOAD DATA LOCAL INFILE)
+    "insert_mode": "multirow",
+    "insert_chunk_size": 1000,
+    # lets connections send local files to the server, which the "load_data" mode needs whether it is the configured
+    #  insert_mode or chosen per batch_insert call (the server must have local_infile enabled as well). Off by default:
+    #  a connection allowing it lets the server request any file the client can read.
+    "allow_local_infile": False
+}
+INGEST = {
+    # decode the ZIP files in a process pool while a writer thread drains the batches into the database
+    "pipelined": True,
+    "workers": None,
+    "queue_depth": 4
+}
 PLOT = {
     "images_output_path": "images",
     "images_tmp_path": "/tmp",
-    "shape_files_path": "shapefiles"
+    "shape_files_path": "shapefiles",
+    "shape_cache_path": "cache/shapes",
+    "shape_simplify_tolerance": None,
+    "cities_cache_file": "cache/cities.npy",
+    "render_workers": None,
+    # written per state and date: "png" (image_dpi), "thumbnail" (png at thumbnail_dpi, drawn in the same pass),
+    #  "geojson" (MultiPoint of the plotted cities) and "points" (float32 longitude/latitude pairs in a .npy file)
+    "output_formats": ["png"],
+    "image_dpi": 300,
+    "thumbnail_dpi": 50,
+    # digest of the points last rendered for each state; states whose points did not change are linked, not rendered
+    "render_manifest_file": "cache/render_manifest.json"
 }
 PREDICTION = {
     "idCountry": 1,
     "days_to_predict": 10,
     "url": "https://wuhan-coronavirus-api.laeyoung.endpoint.ainize.ai/jhu-edu/timeseries?iso2=BR",
-    "jhu_date_pattern": "%m/%d/%y"
+    "jhu_date_pattern": "%m/%d/%y",
+    # where the national series comes from: "http" (the url above), "file" (fixture_file) or "database"
+    "source": "http",
+    "http_cache_path": "cache/http",
+    "http_timeout": 30,
+    "http_retries": 3,
+    "fixture_file": None,
+    # candidate inputs evaluated per predict call while searching the point where the model output crosses 1
+    "batch_size": 1024,
+    "max_search_steps": 1000000,
+    # "batched" scans the candidates in order; "bisection" assumes a monotonic model
+    "crossing_search": "batched",
+    "epochs": 100,
+    "train_batch_size": 1,
+    # per region training: models warm-start from their checkpoint for a few epochs when one exists
+    "checkpoints_path": "cache/models",
+    "warm_start_epochs": 10,
+    "early_stopping_patience": 5,
+    "training_workers": None
 }
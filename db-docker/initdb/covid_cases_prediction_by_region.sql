@@ -0,0 +1,20 @@
+-- predictions of the per-region LSTM models (lstm_training.py), one row per region, entrance date and predicted day.
+-- The predictions of an entrance date are replaced as a whole, hence the index on entranceDate.
+
+CREATE TABLE IF NOT EXISTS covid_cases_prediction_by_state (
+    idState INT NOT NULL,
+    predictedCases DOUBLE NOT NULL,
+    datePrediction DATETIME NOT NULL,
+    entranceDate DATETIME NOT NULL,
+    PRIMARY KEY (idState, entranceDate, datePrediction),
+    KEY idx_prediction_by_state_entrance_date (entranceDate)
+);
+
+CREATE TABLE IF NOT EXISTS covid_cases_prediction_by_city (
+    idCity INT NOT NULL,
+    predictedCases DOUBLE NOT NULL,
+    datePrediction DATETIME NOT NULL,
+    entranceDate DATETIME NOT NULL,
+    PRIMARY KEY (idCity, entranceDate, datePrediction),
+    KEY idx_prediction_by_city_entrance_date (entranceDate)
+);
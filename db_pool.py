@@ -0,0 +1,104 @@
+import logging
+import queue
+import threading
+import time
+
+
+class PoolExhaustedError(Exception):
+    pass
+
+
+class PoolMetrics(object):
+    def __init__(self):
+        self.acquisitions: int = 0
+        self.created: int = 0
+        self.reused: int = 0
+        self.discarded: int = 0
+        self.wait_time_total: float = 0.0
+        self.wait_time_max: float = 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "acquisitions": self.acquisitions,
+            "created": self.created,
+            "reused": self.reused,
+            "discarded": self.discarded,
+            "reuse_ratio": self.reused / self.acquisitions if self.acquisitions else 0.0,
+            "wait_time_total": self.wait_time_total,
+            "wait_time_max": self.wait_time_max
+        }
+
+
+def _is_alive(connection) -> bool:
+    is_connected = getattr(connection, "is_connected", None)
+    return is_connected() if is_connected else True
+
+
+class ConnectionPool(object):
+    # a small thread safe pool: at most `size` connections are handed out at once and idle connections are reused in
+    #  LIFO order, so the most recently used (hence most likely alive) one is picked first
+
+    def __init__(self, connection_factory, size: int = 4, timeout: float = None):
+        self._connection_factory = connection_factory
+        self._timeout: float = timeout
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self.metrics = PoolMetrics()
+
+    def acquire(self):
+        start = time.perf_counter()
+        if not self._slots.acquire(timeout=self._timeout):
+            raise PoolExhaustedError(f"No database connection became available within {self._timeout}s.")
+        waited = time.perf_counter() - start
+        try:
+            connection, reused = self._idle_connection(), True
+            if connection is None:
+                connection, reused = self._connection_factory(), False
+        except BaseException:
+            self._slots.release()
+            raise
+        with self._lock:
+            self.metrics.acquisitions += 1
+            self.metrics.wait_time_total += waited
+            self.metrics.wait_time_max = max(self.metrics.wait_time_max, waited)
+            if reused:
+                self.metrics.reused += 1
+            else:
+                self.metrics.created += 1
+        return connection
+
+    def release(self, connection, discard: bool = False):
+        # liveness is only checked on acquire, since is_connected() costs a round trip to the server (a ping)
+        try:
+            if discard:
+                self._close(connection)
+            else:
+                self._idle.put(connection)
+        finally:
+            self._slots.release()
+
+    def close(self):
+        while True:
+            try:
+                self._close(self._idle.get_nowait())
+            except queue.Empty:
+                break
+
+    def _idle_connection(self):
+        while True:
+            try:
+                connection = self._idle.get_nowait()
+            except queue.Empty:
+                return None
+            if _is_alive(connection):
+                return connection
+            self._close(connection)
+
+    def _close(self, connection):
+        with self._lock:
+            self.metrics.discarded += 1
+        try:
+            connection.close()
+        except Exception as error:
+            logging.warning(f"Failed to close a pooled connection: {error}")
@@ -1,14 +1,53 @@
 import csv
+import hashlib
+import io
+import json
 import logging
+import numpy
 import os
 import re
-from config import CSV_FILENAME, ZIP_FILENAME_PATTERN, LOG_LEVEL, PLOT
+import time
+from config import CSV_FILENAME, CSV_MANIFEST_PATH, ZIP_FILENAME_PATTERN, PLOT
 from datetime import datetime
-from functools import reduce
-from util import time_to_fsstr, fsstr_to_time, mdbstr_to_time
+from instrumentation import span, timed
+from typing import Iterator
+from util import atomic_write, time_to_fsstr, fsstr_to_time, mdbstr_to_time, time_to_mdbstr
 from zipfile import ZipFile
 
-logging.basicConfig(level=LOG_LEVEL)
+
+CASES_DTYPE = numpy.dtype([("idCountry", "i4"), ("idState", "i4"), ("idCity", "i4"), ("cases", "i4")])
+_CSV_HEADER_ALIASES = {"confirmed": "cases", "lastUpdate": "entranceDate"}
+OUTPUT_SUFFIXES = {"png": ".png", "thumbnail": "_thumb.png", "geojson": ".geojson", "points": ".npy"}
+
+state_name_to_initial = {
+    "ACRE": "AC",
+    "ALAGOAS": "AL",
+    "AMAZONAS": "AM",
+    "AMAPÁ": "AP",
+    "BAHIA": "BA",
+    "CEARÁ": "CE",
+    "DISTRITO FEDERAL": "DF",
+    "ESPÍRITO SANTO": "ES",
+    "GOIÁS": "GO",
+    "MARANHÃO": "MA",
+    "MATO GROSSO": "MT",
+    "MATO GROSSO DO SUL": "MS",
+    "MINAS GERAIS": "MG",
+    "PARÁ": "PA",
+    "PARAÍBA": "PB",
+    "PERNAMBUCO": "PE",
+    "PIAUÍ": "PI",
+    "RIO DE JANEIRO": "RJ",
+    "RIO GRANDE DO NORTE": "RN",
+    "RIO GRANDE DO SUL": "RS",
+    "RONDÔNIA": "RO",
+    "RORAIMA": "RR",
+    "SANTA CATARINA": "SC",
+    "SÃO PAULO": "SP",
+    "SERGIPE": "SE",
+    "TOCANTINS": "TO",
+    "PARANÁ": "PR"
+}
 
 
 def get_shape_file_path(initials: str) -> str:
@@ -24,12 +63,28 @@ def get_state_shape_file_path(initials: str, cd_geocuf: str) -> str:
     return os.path.join(get_shape_file_path(initials), f"{cd_geocuf}MUE250GC_SIR.shp")
 
 
-def get_images_dst_filename(entrance_date: str, initials: str) -> str:
+def get_images_dst_filename(entrance_date: str, initials: str, output_format: str = "png") -> str:
     path = os.path.join(PLOT.get("images_output_path"), initials)
     date_only = time_to_fsstr(mdbstr_to_time(entrance_date))
     if not os.path.exists(path) or not os.path.isdir(path):
         os.makedirs(path)
-    return os.path.join(path, f"{date_only}.png")
+    return os.path.join(path, f"{date_only}{OUTPUT_SUFFIXES[output_format]}")
+
+
+def get_output_filenames(entrance_date: str, initials: str) -> dict:
+    # output format -> file name, for every format enabled in PLOT["output_formats"]
+    return {output_format: get_images_dst_filename(entrance_date, initials, output_format)
+            for output_format in PLOT.get("output_formats")}
+
+
+def images_rendered(entrance_date: str) -> bool:
+    # the images of a date are up to date when all of them exist and were written after the data entrance date
+    data_timestamp = mdbstr_to_time(entrance_date).timestamp()
+    for initials in ["BR"] + list(state_name_to_initial.values()):
+        for output_file in get_output_filenames(entrance_date, initials).values():
+            if not os.path.exists(output_file) or os.path.getmtime(output_file) < data_timestamp:
+                return False
+    return True
 
 
 def datetime_from_filename(filename: str) -> datetime:
@@ -40,60 +95,153 @@ def datetime_from_filename(filename: str) -> datetime:
         return None
 
 
-def get_data_from_csv(zip_filename):
-    csv_filename = _extract_csv_from_zip(zip_filename, "/tmp")
-    with open(csv_filename) as csv_file:
-        header = csv_file.readline()\
-            .replace("\"", "")\
-            .replace("\n", "")\
-            .replace("confirmed", "cases")\
-            .replace("lastUpdate", "entranceDate")\
-            .split(",")
-        csv_reader = csv.reader(csv_file, delimiter=",")
-        attrs_index = {a: header.index(a) for a in ["idCountry", "idState", "idCity", "cases", "entranceDate"]}
-        data_dict = {}
-        for line_number, row in enumerate(csv_reader):
-            data_dict[int(row[attrs_index["idCity"]])] = {a: row[v] for a, v in attrs_index.items()}
-        logging.info(f"Processed {line_number} lines from filesystem.")
-    return data_dict
+def iter_csv_rows(zip_filename: str) -> Iterator[tuple]:
+    # the CSV member is decoded straight from the ZIP file and only the columns of CASES_DTYPE are parsed
+    with ZipFile(zip_filename, "r") as zip_obj, zip_obj.open(CSV_FILENAME) as csv_member:
+        csv_reader = csv.reader(io.TextIOWrapper(csv_member, encoding="utf-8-sig", newline=""), delimiter=",")
+        header = [_CSV_HEADER_ALIASES.get(a, a) for a in next(csv_reader)]
+        attrs_index = [header.index(a) for a in CASES_DTYPE.names]
+        for row in csv_reader:
+            yield tuple(int(row[i]) for i in attrs_index)
+
 
+@timed("zip_csv_parse", rows=len)
+def get_data_from_csv(zip_filename: str) -> numpy.ndarray:
+    data = numpy.array(list(iter_csv_rows(zip_filename)), dtype=CASES_DTYPE)
+    logging.info(f"Processed {data.size} lines from filesystem.")
+    return data
 
-def _extract_csv_from_zip(zip_filename: str, dest_path: str) -> str:
-    with ZipFile(zip_filename, "r") as zipObj:
-        zipObj.extract(CSV_FILENAME, dest_path)
-    return os.path.join(dest_path, CSV_FILENAME)
 
+def _file_digest(filename: str) -> str:
+    digest = hashlib.sha1()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
 
-def _datetimes_from_filenames(filenames: list) -> filter:
-    return filter(lambda e: e is not None, map(lambda e: datetime_from_filename(e), filenames))
+
+def _latest_by_day(entries) -> dict:
+    # day ("YYYY-MM-DD") -> [key, sha1] of the latest of the (key, sha1) `entries` in that day
+    days: dict = {}
+    for key, sha1 in entries:
+        if key and key > days.get(key[:10], [""])[0]:
+            days[key[:10]] = [key, sha1]
+    return days
+
+
+class FileIndex(object):
+    # on-disk manifest of the CSV directory. Each entry holds the sortable key ("YYYY-MM-DD HH:MM:SS") of the datetime
+    #  in the file name, its size, mtime and content hash; on refresh only the names that are new or whose size or mtime
+    #  changed are parsed and hashed again. Along with it a summary keeps the latest file of each day and the directory
+    #  mtime it was built at: ZIP files are dropped whole into the directory (created or renamed into place), which
+    #  always changes its mtime, so while that is unchanged neither the directory nor the full manifest is read.
+
+    def __init__(self, path: str, manifest_filename: str = None):
+        self._path: str = path
+        key = hashlib.sha1(os.path.abspath(path).encode("utf-8")).hexdigest()[:12]
+        self._manifest_filename: str = manifest_filename if manifest_filename else \
+            os.path.join(CSV_MANIFEST_PATH, f"manifest_{key}.json")
+        self._summary_filename: str = f"{os.path.splitext(self._manifest_filename)[0]}_days.json"
+        self._entries: dict = None
+
+    def refresh(self) -> dict:
+        previous_entries = self._load_entries()
+        entries: dict = {}
+        changed = False
+        with span("file_index_refresh") as info, os.scandir(self._path) as dir_entries:
+            for dir_entry in dir_entries:
+                if not dir_entry.is_file():
+                    continue
+                stat = dir_entry.stat()
+                entry = previous_entries.get(dir_entry.name)
+                if not entry or "key" not in entry or entry["size"] != stat.st_size or \
+                        entry["mtime"] != stat.st_mtime_ns:
+                    file_datetime = datetime_from_filename(dir_entry.name)
+                    entry = {
+                        "key": time_to_mdbstr(file_datetime) if file_datetime else None,
+                        "size": stat.st_size,
+                        "mtime": stat.st_mtime_ns,
+                        "sha1": _file_digest(dir_entry.path) if file_datetime else None
+                    }
+                    changed = True
+                entries[dir_entry.name] = entry
+            info["rows"] = len(entries)
+        self._entries = entries
+        if changed or len(entries) != len(previous_entries):
+            atomic_write(self._manifest_filename, lambda f: json.dump(entries, f), "w")
+        return entries
+
+    def latest_by_day(self) -> dict:
+        # day ("YYYY-MM-DD") -> [key, sha1] of the latest file of each day in the directory
+        dir_mtime = os.stat(self._path).st_mtime_ns
+        summary = _load_json(self._summary_filename)
+        if summary.get("dir_mtime") == dir_mtime:
+            return summary["days"]
+        scan_time = time.time_ns()
+        days = _latest_by_day((e["key"], e["sha1"]) for e in self.refresh().values())
+        # a directory modified right before the scan may still change within the same mtime tick, hence its mtime is
+        #  only trusted once it is a couple of seconds old
+        summary = {"dir_mtime": dir_mtime if scan_time - dir_mtime > 2 * 10 ** 9 else None, "days": days}
+        atomic_write(self._summary_filename, lambda f: json.dump(summary, f), "w")
+        return days
+
+    def digest(self, key: str) -> str:
+        entries = self._entries if self._entries is not None else self._load_entries()
+        return next((e["sha1"] for e in entries.values() if e.get("key") == key), None)
+
+    def _load_entries(self) -> dict:
+        if self._entries is None:
+            self._entries = _load_json(self._manifest_filename)
+        return self._entries
+
+
+def _load_json(filename: str) -> dict:
+    try:
+        with open(filename) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
 
 
 class FSHandler(object):
-    def __init__(self, path: str, previous_datetime: datetime = None, start_datetime: datetime = None):
+    def __init__(self, path: str, previous_datetime: datetime = None, start_datetime: datetime = None,
+                 file_datetimes: list = None):
+        # file_datetimes replaces the listing of the CSV directory, e.g. by the datetimes held in the snapshot store
         self._path: str = path
         self._start_datetime: datetime = start_datetime if start_datetime else datetime.min
         self._previous_datetime: datetime = previous_datetime
+        self._file_datetimes: list = file_datetimes
         self._files_to_process: list = self._populate_files_to_process_list()
 
     def get_files_to_process(self) -> list:
         return self._files_to_process
 
     def _populate_files_to_process_list(self):
-        files_dt = list(filter(lambda e: e > self._start_datetime, _datetimes_from_filenames(os.listdir(self._path))))
-        if not files_dt:
+        # we reduce the datetimes listed from the CSV directory to only one for each day. For instance, if the directory
+        #  contains csv_dados_31_05_2020-05_00_02.zip, ... and csv_dados_31_05_2020-22_59_01.zip the result must contain
+        #  only the file with the latest date in name: csv_dados_31_05_2020-22_59_01.zip. The files are compared and
+        #  grouped by their sortable "YYYY-MM-DD HH:MM:SS" keys and only the selected ones are parsed into datetimes.
+        if self._file_datetimes is not None:
+            file_index = None
+            days = _latest_by_day((time_to_mdbstr(e), None) for e in self._file_datetimes)
+        else:
+            file_index = FileIndex(self._path)
+            days = file_index.latest_by_day()
+        start_key = time_to_mdbstr(self._start_datetime) if self._start_datetime != datetime.min else ""
+        keys = sorted((key for key, _ in days.values() if key > start_key), reverse=True)
+        if not keys:
             logging.info(f"There is no CSV file to process since {time_to_fsstr(self._start_datetime)}")
             return []
-        # we reduce the list of files datetimes listed from the CSV directory to only one for each day. For instance, if
-        #  the list contains csv_dados_31_05_2020-05_00_02.zip, ... and csv_dados_31_05_2020-22_59_01.zip the result
-        #  list must contain only the file with the latest date in name: csv_dados_31_05_2020-22_59_01.zip
-        files_dt = sorted(files_dt, reverse=True)
-        datetimes = reduce(lambda a, e: a+[e] if (e > a[-1] or e.date() < a[-1].date()) else a,
-                           files_dt,
-                           [files_dt[0]])
-        # if the date of oldest datetime is equal to _start_datetime it means we are handling a same day update case
-        if datetimes[0].date() == self._start_datetime.date():
+        datetimes = [mdbstr_to_time(k) for k in keys]
+        # if the date of the latest datetime is equal to _start_datetime it means we are handling a same day update case
+        if keys[0][:10] == start_key[:10]:
+            digest = days[keys[0][:10]][1]
+            if digest and file_index and digest == file_index.digest(start_key):
+                logging.info(f"The content of the CSV file of {time_to_fsstr(datetimes[0])} is identical to the one "
+                             f"already processed ({time_to_fsstr(self._start_datetime)}). Nothing to update.")
+                return []
             datetimes.append(self._previous_datetime)
-        elif self._start_datetime != datetime.min:
+        elif start_key:
             # we add to the list the last file used to populate the history table in order to use it as a baseline
             datetimes.append(self._start_datetime)
         return list(map(lambda e: os.path.join(self._path, f"csv_dados_{time_to_fsstr(e)}.zip"), sorted(datetimes)))
@@ -0,0 +1,78 @@
+import collections
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+from cases_diff import DailyGrowthReducer
+from concurrent.futures import ProcessPoolExecutor
+from config import INGEST
+from fs_handler import datetime_from_filename
+from instrumentation import span
+from snapshot_store import load_snapshot
+from util import time_to_mdbstr
+
+_DONE = object()
+
+
+def _drain(batches: queue.Queue, write_batch, errors: list):
+    while True:
+        item = batches.get()
+        if item is _DONE:
+            return
+        if errors:
+            # a previous write failed: keep draining so the producer never blocks on a full queue
+            continue
+        try:
+            write_batch(*item)
+        except Exception as error:
+            errors.append(error)
+
+
+def run_pipeline(files: list, write_batch, workers: int = None, queue_depth: int = None):
+    # ZIP files are decoded ahead of time by a process pool, reduced in order into daily growth batches by this thread
+    #  and handed through a bounded queue to a writer thread calling write_batch(file, batch). The decoding read-ahead
+    #  is bounded too, so a slow database applies backpressure all the way up to the decoders.
+    workers = workers or INGEST.get("workers") or os.cpu_count() or 1
+    queue_depth = queue_depth if queue_depth else INGEST.get("queue_depth")
+    reducer = DailyGrowthReducer()
+    batches = queue.Queue(maxsize=queue_depth)
+    errors = []
+    writer = threading.Thread(target=_drain, args=(batches, write_batch, errors), name="ingest-writer")
+    # the decoders are started on demand, after the writer thread already runs; a plain fork could then copy a lock
+    #  (logging, instrumentation) held by the writer into a child, so they come from a fork server or are spawned
+    start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(start_method))
+    writer.start()
+    try:
+        with executor:
+            read_ahead = workers + queue_depth
+            pending = collections.deque()
+            files_iter = iter(files)
+            for file in files_iter:
+                pending.append((file, executor.submit(load_snapshot, file)))
+                if len(pending) >= read_ahead:
+                    break
+            while pending:
+                file, future = pending.popleft()
+                next_file = next(files_iter, None)
+                if next_file:
+                    pending.append((next_file, executor.submit(load_snapshot, next_file)))
+                logging.info(f"Processing file {file}.")
+                # the zip_csv_parse and snapshot_load spans are recorded inside the decoders and never reach this
+                #  process, so the time spent waiting here for each decoded file is recorded instead
+                with span("zip_decode") as info:
+                    data = future.result()
+                    info["rows"] = len(data)
+                batch = reducer.reduce(time_to_mdbstr(datetime_from_filename(file)), data)
+                if errors:
+                    break
+                if not batch.empty:
+                    batches.put((file, batch))
+            for _, future in pending:
+                future.cancel()
+    finally:
+        batches.put(_DONE)
+        writer.join()
+    if errors:
+        raise errors[0]
@@ -0,0 +1,89 @@
+import functools
+import json
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+
+_lock = threading.Lock()
+_spans: dict = {}
+
+
+def _record(name: str, seconds: float, rows: int = None):
+    with _lock:
+        stats = _spans.setdefault(name, {"calls": 0, "seconds": 0.0, "max_seconds": 0.0, "rows": 0})
+        stats["calls"] += 1
+        stats["seconds"] += seconds
+        stats["max_seconds"] = max(stats["max_seconds"], seconds)
+        stats["rows"] += rows if rows else 0
+
+
+@contextmanager
+def span(name: str, rows: int = None):
+    # times the block under `name`; the row count may also be set from within it through the yielded dict
+    info = {"rows": rows}
+    start = time.perf_counter()
+    try:
+        yield info
+    finally:
+        _record(name, time.perf_counter() - start, info["rows"])
+
+
+def timed(name: str, rows=None):
+    # decorator version of span; `rows`, if given, is called with the function result to count the rows it handled
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name) as info:
+                result = func(*args, **kwargs)
+                info["rows"] = rows(result) if rows else None
+                return result
+        return wrapper
+    return decorator
+
+
+def peak_rss_bytes() -> int:
+    # ru_maxrss is reported in kilobytes on Linux and in bytes on macOS. RUSAGE_CHILDREN only covers waited for
+    #  children of this process: the ingest decoders are children of the fork server and are not counted
+    scale = 1 if sys.platform == "darwin" else 1024
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) * scale
+
+
+def snapshot() -> dict:
+    with _lock:
+        spans = {name: dict(stats, rows_per_second=stats["rows"] / stats["seconds"] if stats["seconds"] else 0.0)
+                 for name, stats in _spans.items()}
+    return {"spans": spans, "peak_rss_bytes": peak_rss_bytes()}
+
+
+def reset():
+    with _lock:
+        _spans.clear()
+
+
+def to_json() -> str:
+    return json.dumps(snapshot(), indent=2, sort_keys=True)
+
+
+def to_prometheus() -> str:
+    metrics = snapshot()
+    lines = []
+    for metric, key, kind in [("c19_span_calls_total", "calls", "counter"),
+                              ("c19_span_seconds_total", "seconds", "counter"),
+                              ("c19_span_max_seconds", "max_seconds", "gauge"),
+                              ("c19_span_rows_total", "rows", "counter"),
+                              ("c19_span_rows_per_second", "rows_per_second", "gauge")]:
+        lines.append(f"# TYPE {metric} {kind}")
+        lines.extend(f'{metric}{{span="{name}"}} {stats[key]}' for name, stats in sorted(metrics["spans"].items()))
+    lines.append("# TYPE c19_peak_rss_bytes gauge")
+    lines.append(f"c19_peak_rss_bytes {metrics['peak_rss_bytes']}")
+    return "\n".join(lines) + "\n"
+
+
+def export(filename: str):
+    # Prometheus text format for .prom files, JSON otherwise
+    with open(filename, "w") as f:
+        f.write(to_prometheus() if filename.endswith(".prom") else to_json())
@@ -1,15 +1,18 @@
-import json
+import logging
 import os
 import numpy
 import pandas
+import sys
 from config import PREDICTION
 from datetime import timedelta
 from keras.models import Sequential
 from keras.layers import Dense
 from keras.layers import LSTM
 from sklearn.preprocessing import MinMaxScaler
+from instrumentation import span, timed
 from lstm_dao import LstmDao
-from util import jhustr_to_mdbstr, mdbstr_to_time, time_to_mdbstr
+from timeseries_source import get_source, series_fingerprint
+from util import mdbstr_to_time, time_to_mdbstr
 
 
 # convert an array of values into a dataset matrix
@@ -22,16 +25,58 @@ def create_dataset(ds, lb=1):
     return numpy.array(data_x), numpy.array(data_y)
 
 
-def get_data():
-    import requests
-    response = requests.get(PREDICTION.get("url"))
-    if response.status_code == 200:
-        return json.loads(response.text)[0]
-    return {}
-
-
-def get_covid_cases_from_first_case():
-    covid_cases = {jhustr_to_mdbstr(k): v.get('confirmed', 0) for k, v in get_data().get('timeseries', {}).items()}
+def create_model(lb=1):
+    model = Sequential()
+    model.add(LSTM(4, input_shape=(1, lb)))
+    model.add(Dense(1))
+    model.compile(loss='mean_squared_error', optimizer='adam')
+    return model
+
+
+def _model_outputs(model, inputs: numpy.ndarray, batch_size: int) -> numpy.ndarray:
+    return model.predict(numpy.reshape(inputs, (inputs.size, 1, 1)), batch_size=batch_size).ravel()
+
+
+@timed("predict_crossing")
+def find_crossing_input(model, start: float, increment: float, batch_size: int = None, max_steps: int = None) -> float:
+    # first input in start, start + increment, ... whose prediction is not below 1. The candidates are evaluated in
+    #  batches of `batch_size` per predict call or, with PREDICTION["crossing_search"] = "bisection", the crossing
+    #  point is bracketed by doubling and then bisected down to `increment` (which assumes a monotonic model).
+    batch_size = batch_size if batch_size else PREDICTION.get("batch_size")
+    max_steps = max_steps if max_steps else PREDICTION.get("max_search_steps")
+    if PREDICTION.get("crossing_search") == "bisection":
+        low, high = 0, 1
+        while _model_outputs(model, numpy.array([start + high * increment]), 1)[0] < 1:
+            low, high = high, high * 2
+            if high > max_steps:
+                raise ValueError(f"The model output did not reach 1 within {max_steps} steps.")
+        if _model_outputs(model, numpy.array([start]), 1)[0] >= 1:
+            return start
+        while high - low > 1:
+            middle = (low + high) // 2
+            if _model_outputs(model, numpy.array([start + middle * increment]), 1)[0] < 1:
+                low = middle
+            else:
+                high = middle
+        return start + high * increment
+    for offset in range(0, max_steps, batch_size):
+        candidates = start + increment * numpy.arange(offset, offset + batch_size)
+        crossed = numpy.nonzero(~(_model_outputs(model, candidates, batch_size) < 1))[0]
+        if crossed.size:
+            return candidates[crossed[0]]
+    raise ValueError(f"The model output did not reach 1 within {max_steps} steps.")
+
+
+@timed("predict_horizon", rows=len)
+def predict_horizon(model, scaler, start: float, increment: float, horizon: int = None) -> list:
+    # the predicted cases of the `horizon` steps following `start`, produced by a single batched predict call
+    horizon = horizon if horizon else PREDICTION.get("days_to_predict", 10)
+    inputs = start + increment * numpy.arange(horizon)
+    return scaler.inverse_transform(_model_outputs(model, inputs, horizon).reshape(-1, 1)).ravel().tolist()
+
+
+def get_covid_cases_from_first_case(series: dict) -> dict:
+    covid_cases = {k: series[k] for k in sorted(series)}
     for cases_date in list(covid_cases.keys()):
         if covid_cases[cases_date] == 0:
             del covid_cases[cases_date]
@@ -40,12 +85,37 @@ def get_covid_cases_from_first_case():
     return covid_cases
 
 
-if __name__ == "__main__":
+def _fingerprint_filename() -> str:
+    return os.path.join(PREDICTION.get("checkpoints_path"), f"country_{PREDICTION.get('idCountry')}.sha1")
+
+
+def series_changed(fingerprint: str) -> bool:
+    try:
+        with open(_fingerprint_filename()) as f:
+            return f.read().strip() != fingerprint
+    except OSError:
+        return True
+
+
+def save_fingerprint(fingerprint: str):
+    os.makedirs(os.path.dirname(_fingerprint_filename()), exist_ok=True)
+    with open(_fingerprint_filename(), "w") as f:
+        f.write(fingerprint)
+
+
+def predict(db_handler: LstmDao, force: bool = False):
     # fix random seed for reproducibility
     numpy.random.seed(7)
 
+    series = get_source(db_handler=db_handler).get_series()
+    fingerprint = series_fingerprint(series)
+    if not force and not series_changed(fingerprint):
+        logging.info("The cases time series did not change since the last prediction. Nothing to do.")
+        return
+
     # load the dataset
-    dataframe = pandas.DataFrame.from_dict(get_covid_cases_from_first_case(), orient='index', columns=['cases'])
+    dataframe = pandas.DataFrame.from_dict(get_covid_cases_from_first_case(series), orient='index',
+                                           columns=['cases'])
     dataset = dataframe.filter(['cases'], axis=1).values
     dataset = dataset.astype('float32')
 
@@ -53,8 +123,7 @@ if __name__ == "__main__":
     scaler = MinMaxScaler(feature_range=(0, 1))
     dataset = scaler.fit_transform(dataset)
 
-    # split into train and test sets
-    train_size = int(len(dataset))
+    # the whole series is used for training
     train = dataset
 
     # reshape into X=t and Y=t+1
@@ -65,34 +134,34 @@ if __name__ == "__main__":
     train_x = numpy.reshape(train_x, (train_x.shape[0], 1, train_x.shape[1]))
 
     # create and fit the LSTM network
-    model = Sequential()
-    model.add(LSTM(4, input_shape=(1, look_back)))
-    model.add(Dense(1))
-    model.compile(loss='mean_squared_error', optimizer='adam')
-    model.fit(train_x, train_y, epochs=100, batch_size=1, verbose=2)
-
-    # make predictions
-    train_predict = model.predict(train_x)
-    increment = 1 / train_predict.size
-    day = 1
+    model = create_model(look_back)
+    with span("train", rows=train_x.shape[0]):
+        model.fit(train_x, train_y, epochs=PREDICTION.get("epochs"), batch_size=PREDICTION.get("train_batch_size"),
+                  verbose=2)
 
-    while bool(model.predict(numpy.reshape(day, (1, 1, 1))) < 1):
-        day += increment
+    # make predictions, stepping the input by one over the number of training samples
+    increment = 1 / train_x.shape[0]
+    day = find_crossing_input(model, 1, increment)
 
     predictions = []
     entrance_date_str = dataframe.index.max()
     date_prediction = mdbstr_to_time(entrance_date_str)
-    for i in range(PREDICTION.get("days_to_predict", 10)):
+    for predicted_cases in predict_horizon(model, scaler, day, increment):
         date_prediction = date_prediction + timedelta(days=1)
         predictions.append({
             "idCountry": PREDICTION.get("idCountry"),
-            "predictedCases": scaler.inverse_transform(model.predict(numpy.reshape(day, (1, 1, 1)))).tolist()[0][0],
+            "predictedCases": predicted_cases,
             "datePrediction": time_to_mdbstr(date_prediction),
             "entranceDate": entrance_date_str
         })
-        day += increment
 
-    db_handler = LstmDao(host=os.environ.get("DB_HOST", "localhost"), database=os.environ.get("DB_NAME", "covid"),
-                         user=os.environ.get("DB_USER", "root"), password=os.environ.get("DB_PASS", "root"))
-    db_handler.delete_cases_prediction_if_exists(entrance_date_str)
-    db_handler.persist_cases_prediction(predictions)
+    # the old predictions of the date are replaced by the new ones in a single transaction
+    with db_handler.session():
+        db_handler.delete_cases_prediction_if_exists(entrance_date_str)
+        db_handler.persist_cases_prediction(predictions)
+    save_fingerprint(fingerprint)
+
+
+if __name__ == "__main__":
+    import cli
+    cli.main(["predict"] + sys.argv[1:])
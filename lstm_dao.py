@@ -1,10 +1,19 @@
-import pandas
+import logging
 from mariadb_handler import MariaDBHandler
+from typing import TYPE_CHECKING
+from util import time_to_mdbstr
+
+if TYPE_CHECKING:
+    import pandas
+
+
+REGION_COLUMNS = {"country": "idCountry", "state": "idState", "city": "idCity"}
 
 
 class LstmDao(MariaDBHandler):
-    def __init__(self, host: str, database: str, user: str, password: str):
-        super(LstmDao, self).__init__(host, database, user, password)
+    def __init__(self, host: str, database: str, user: str, password: str, pool_size: int = None,
+                 connection_factory=None):
+        super(LstmDao, self).__init__(host, database, user, password, pool_size, connection_factory)
 
     def persist_cases_prediction(self, data: list):
         if data:
@@ -12,7 +21,46 @@ class LstmDao(MariaDBHandler):
                            VALUES (%(idCountry)s, %(predictedCases)s, %(datePrediction)s, %(entranceDate)s)"""
             self._batch_executor(stmt, data)
 
+    def get_latest_prediction_entrance_date(self, level: str = "country"):
+        query = f"SELECT MAX(entranceDate) FROM covid_cases_prediction_by_{level}"
+        return self._query_executor(query)[0][0]
+
     def delete_cases_prediction_if_exists(self, entrance_date_str):
         stmt = """DELETE FROM covid_cases_prediction_by_country
                         WHERE entranceDate = %(entranceDate)s"""
         self._batch_executor(stmt, [{"entranceDate": entrance_date_str}])
+
+    def get_cases_series_by_region(self, level: str, aggregates=None) -> "pandas.DataFrame":
+        # daily new cases of every country, state or city ("level"), as (idRegion, entranceDate, cases) rows. The state
+        #  and country series are read from the totals the aggregate store maintains while ingesting, as long as they
+        #  span the same entrance dates as the history table; otherwise, and for cities, the history table is scanned.
+        if level in ("state", "country"):
+            from aggregate_store import AggregateStore
+            aggregates = aggregates if aggregates else AggregateStore()
+            query = "SELECT MIN(entranceDate), MAX(entranceDate) FROM covid_cases_history"
+            first, last = self._query_executor(query)[0]
+            if first and (aggregates.first_entrance_date(), aggregates.last_entrance_date()) == \
+                    (time_to_mdbstr(first), time_to_mdbstr(last)):
+                return aggregates.region_series(level)
+            logging.warning("The aggregates do not span the whole history; reading the series from "
+                            "covid_cases_history. Run 'ingest --rebuild-aggregates' to rebuild them.")
+        column = REGION_COLUMNS[level]
+        query = f"""SELECT {column} AS idRegion, entranceDate, SUM(cases) AS cases
+                      FROM covid_cases_history
+                     GROUP BY {column}, entranceDate
+                     ORDER BY {column}, entranceDate"""
+        return self._read_sql(query)
+
+    # the covid_cases_prediction_by_state and covid_cases_prediction_by_city tables are created by
+    #  db-docker/initdb/covid_cases_prediction_by_region.sql
+    def persist_region_cases_prediction(self, level: str, data: list):
+        if data:
+            stmt = f"""INSERT INTO covid_cases_prediction_by_{level}
+                                   ({REGION_COLUMNS[level]}, predictedCases, datePrediction, entranceDate)
+                            VALUES (%(idRegion)s, %(predictedCases)s, %(datePrediction)s, %(entranceDate)s)"""
+            self._batch_executor(stmt, data)
+
+    def delete_region_cases_prediction_if_exists(self, level: str, entrance_date_str):
+        stmt = f"""DELETE FROM covid_cases_prediction_by_{level}
+                         WHERE entranceDate = %(entranceDate)s"""
+        self._batch_executor(stmt, [{"entranceDate": entrance_date_str}])
@@ -0,0 +1,105 @@
+import logging
+import multiprocessing
+import numpy
+import os
+import pickle
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from config import PREDICTION
+from datetime import timedelta
+from instrumentation import span
+from lstm_dao import LstmDao
+from util import mdbstr_to_time, time_to_mdbstr
+
+
+def _checkpoint_files(level: str, id_region: int) -> tuple:
+    path = os.path.join(PREDICTION.get("checkpoints_path"), level)
+    os.makedirs(path, exist_ok=True)
+    return os.path.join(path, f"{id_region}.h5"), os.path.join(path, f"{id_region}_scaler.pickle")
+
+
+def train_region(level: str, id_region: int, entrance_dates: list, cases: numpy.ndarray) -> list:
+    # runs inside a training worker, which is the only place keras gets imported. A region with a checkpoint is
+    #  fine-tuned for a few epochs on the updated series instead of being trained from scratch.
+    from keras.callbacks import EarlyStopping
+    from keras.models import load_model
+    from lstm_cases_prediction import create_dataset, create_model, find_crossing_input, predict_horizon
+    from sklearn.preprocessing import MinMaxScaler
+    if not (cases > 0).any():
+        logging.info(f"No cases in {level} {id_region}; it is not trained.")
+        return []
+    first_case = numpy.argmax(cases > 0)
+    dataset = cases[first_case:].reshape(-1, 1).astype("float32")
+    if dataset.shape[0] < 4:
+        logging.info(f"Not enough data to train the model of {level} {id_region}.")
+        return []
+    model_file, scaler_file = _checkpoint_files(level, id_region)
+    if os.path.exists(model_file) and os.path.exists(scaler_file):
+        model = load_model(model_file)
+        with open(scaler_file, "rb") as f:
+            scaler = pickle.load(f)
+        # the scaler range is widened to cover the new values only
+        scaler.partial_fit(dataset)
+        epochs = PREDICTION.get("warm_start_epochs")
+    else:
+        model = create_model(1)
+        scaler = MinMaxScaler(feature_range=(0, 1)).fit(dataset)
+        epochs = PREDICTION.get("epochs")
+    train_x, train_y = create_dataset(scaler.transform(dataset), 1)
+    train_x = numpy.reshape(train_x, (train_x.shape[0], 1, train_x.shape[1]))
+    model.fit(train_x, train_y, epochs=epochs, batch_size=PREDICTION.get("train_batch_size"), verbose=0,
+              callbacks=[EarlyStopping(monitor="loss", patience=PREDICTION.get("early_stopping_patience"),
+                                       restore_best_weights=True)])
+    model.save(model_file)
+    with open(scaler_file, "wb") as f:
+        pickle.dump(scaler, f)
+    increment = 1 / train_x.shape[0]
+    day = find_crossing_input(model, 1, increment)
+    entrance_date_str = entrance_dates[-1]
+    date_prediction = mdbstr_to_time(entrance_date_str)
+    predictions = []
+    for predicted_cases in predict_horizon(model, scaler, day, increment):
+        date_prediction = date_prediction + timedelta(days=1)
+        predictions.append({
+            "idRegion": id_region,
+            "predictedCases": predicted_cases,
+            "datePrediction": time_to_mdbstr(date_prediction),
+            "entranceDate": entrance_date_str
+        })
+    logging.info(f"Trained the model of {level} {id_region} for up to {epochs} epochs.")
+    return predictions
+
+
+def train_regions(db_handler: LstmDao, level: str = "state", workers: int = None):
+    from aggregate_store import AggregateStore
+    aggregates = AggregateStore()
+    series = db_handler.get_cases_series_by_region(level, aggregates)
+    # the cumulative cases of each region start from those of the baseline file, which the history does not hold
+    baseline = aggregates.baseline(level)
+    series["entranceDate"] = series["entranceDate"].map(lambda e: time_to_mdbstr(e.to_pydatetime()))
+    workers = workers or PREDICTION.get("training_workers") or os.cpu_count() or 1
+    # tensorflow does not survive a fork once initialized, so the workers are spawned
+    with span("train_regions") as info, \
+            ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        futures = {int(id_region): executor.submit(train_region, level, int(id_region),
+                                                   region["entranceDate"].tolist(),
+                                                   region["cases"].cumsum().values + baseline.get(int(id_region), 0))
+                   for id_region, region in series.groupby("idRegion")}
+        predictions = []
+        for id_region, future in futures.items():
+            # a region whose model fails (e.g. its output never reaches 1) is left out without losing the others
+            try:
+                predictions.extend(future.result())
+            except Exception as error:
+                logging.error(f"Failed to train the model of {level} {id_region}: {error}")
+        info["rows"] = len(futures)
+    # the old predictions of the dates are replaced by the new ones in a single transaction
+    with db_handler.session():
+        for entrance_date_str in sorted({p["entranceDate"] for p in predictions}):
+            db_handler.delete_region_cases_prediction_if_exists(level, entrance_date_str)
+        db_handler.persist_region_cases_prediction(level, predictions)
+
+
+if __name__ == "__main__":
+    import cli
+    cli.main(["predict", "--level", "state"] + sys.argv[1:])
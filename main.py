@@ -1,40 +1,80 @@
 import logging
-import os
-from util import time_to_mdbstr
-from config import CSV_FILES_PATH, LOG_LEVEL
-from fs_handler import FSHandler, datetime_from_filename, get_data_from_csv
+import sys
+from config import CSV_FILES_PATH, INGEST
+from datetime import datetime
+from fs_handler import FSHandler, datetime_from_filename
 from mariadb_handler import MariaDBHandler
+from util import time_to_mdbstr
+
+
+def ingest(db_handler: MariaDBHandler, pipelined: bool = None, from_snapshots: bool = False, fs_handler=None,
+           entrance_dates: tuple = None):
+    # `entrance_dates` is the (previous, latest) pair of get_latest_and_previous_entrance_date that `fs_handler` was
+    #  built with; both are looked up here when not given. The pandas based modules (aggregates, daily growth, ingest
+    #  pipeline) are only imported once there is something to ingest; numpy is already loaded by fs_handler.
+    from aggregate_store import AggregateStore
+    from cases_diff import compute_daily_growth
+    from ingest_pipeline import run_pipeline
+    from snapshot_store import load_snapshot
+    entrance_dates = entrance_dates if entrance_dates else db_handler.get_latest_and_previous_entrance_date()
+    start_datetime = entrance_dates[1]
+    aggregates = AggregateStore()
+    if not start_datetime:
+        aggregates.reset()
+    elif aggregates.last_entrance_date() != time_to_mdbstr(start_datetime):
+        # the store is behind (or ahead of) the history table, e.g. its first run on an existing history or a crash
+        #  between a committed write and the matching update; it is rebuilt before anything is appended to it
+        logging.warning(f"Aggregates are at {aggregates.last_entrance_date()} while the history is at "
+                        f"{time_to_mdbstr(start_datetime)}; rebuilding them.")
+        rebuild_aggregates(db_handler, aggregates)
+    if not fs_handler:
+        fs_handler = files_to_ingest(db_handler, from_snapshots, entrance_dates)
+    if not start_datetime and fs_handler.get_files_to_process():
+        # the first file of an empty history only sets the baseline; its cumulative cases are kept aside
+        aggregates.set_baseline(load_snapshot(fs_handler.get_files_to_process()[0]))
+
+    def write_batch(file: str, db_data):
+        if start_datetime and datetime_from_filename(file).date() == start_datetime.date():
+            db_data["entranceDateToUpdate"] = time_to_mdbstr(start_datetime)
+            db_handler.batch_update(db_data)
+            aggregates.update(db_data, replaces=time_to_mdbstr(start_datetime))
+        else:
+            db_handler.batch_insert(db_data)
+            aggregates.update(db_data)
+
+    if pipelined if pipelined is not None else INGEST.get("pipelined"):
+        run_pipeline(fs_handler.get_files_to_process(), write_batch)
+        return
+    snapshots: list = []
+    for file in fs_handler.get_files_to_process():
+        logging.info(f"Processing file {file}.")
+        snapshots.append((time_to_mdbstr(datetime_from_filename(file)), load_snapshot(file)))
+    # since we are calculating the new cases based in the day before, the first file only sets the baseline and its
+    #  batch is empty
+    for file, db_data in zip(fs_handler.get_files_to_process(), compute_daily_growth(snapshots)):
+        if not db_data.empty:
+            write_batch(file, db_data)
+
+
+def files_to_ingest(db_handler: MariaDBHandler, from_snapshots: bool = False,
+                    entrance_dates: tuple = None) -> FSHandler:
+    previous_datetime, start_datetime = entrance_dates if entrance_dates else \
+        db_handler.get_latest_and_previous_entrance_date()
+    file_datetimes = None
+    if from_snapshots:
+        # reading from the snapshot store allows (re)building the history table without touching the ZIP archive
+        from snapshot_store import SnapshotStore
+        file_datetimes = SnapshotStore().datetimes()
+    return FSHandler(CSV_FILES_PATH, previous_datetime, start_datetime, file_datetimes)
+
+
+def rebuild_aggregates(db_handler: MariaDBHandler, aggregates=None):
+    from aggregate_store import AggregateStore
+    history = db_handler.get_history_by_entrance_date_range(datetime.min, datetime.max)
+    history["entranceDate"] = history["entranceDate"].map(lambda e: time_to_mdbstr(e.to_pydatetime()))
+    (aggregates if aggregates else AggregateStore()).rebuild(history)
 
 
-logging.basicConfig(level=LOG_LEVEL)
-db_handler = MariaDBHandler(host=os.environ.get("DB_HOST", "localhost"), database=os.environ.get("DB_NAME", "covid"),
-                            user=os.environ.get("DB_USER", "root"), password=os.environ.get("DB_PASS", "root"))
-previous_datetime, start_datetime = db_handler.get_latest_and_previous_entrance_date()
-fs_handler = FSHandler(CSV_FILES_PATH, previous_datetime, start_datetime)
-cur_data: dict = {}
-
-for file in fs_handler.get_files_to_process():
-    logging.info(f"Processing file {file}.")
-    new_data: dict = get_data_from_csv(file)
-    file_datetime: str = time_to_mdbstr(datetime_from_filename(file))
-    db_data: list = []
-    for id_city, data in new_data.items():
-        # since we are calculating the new cases based in the day before, we must discard the first day. So we
-        #  just add the information to be used in the next iteration and leave
-        if not cur_data.get(id_city, None):
-            cur_data[id_city] = {}
-            cur_data[id_city]["idCountry"] = data.get("idCountry")
-            cur_data[id_city]["idState"] = data.get("idState")
-            cur_data[id_city]["idCity"] = id_city
-            cur_data[id_city]["cases"] = int(data.get("cases"))
-            cur_data[id_city]["entranceDate"] = file_datetime
-            continue
-        cur_data[id_city]["entranceDateToUpdate"] = start_datetime
-        cur_data[id_city]["dailyCasesGrowth"] = int(data.get("cases")) - cur_data[id_city]["cases"]
-        cur_data[id_city]["cases"] = int(data.get("cases"))
-        cur_data[id_city]["entranceDate"] = file_datetime
-        db_data.append(cur_data[id_city].copy())
-    if start_datetime and datetime_from_filename(file).date() == start_datetime.date():
-        db_handler.batch_update(db_data)
-    else:
-        db_handler.batch_insert(db_data)
+if __name__ == "__main__":
+    import cli
+    cli.main(["ingest"] + sys.argv[1:])
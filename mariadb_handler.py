@@ -1,34 +1,142 @@
-from config import LOG_LEVEL
+from config import DATABASE
+from contextlib import contextmanager
 from datetime import datetime
+from db_pool import ConnectionPool
+from instrumentation import timed
+import csv
 import logging
 import mysql.connector as mariadb
-import pandas
+import os
+import tempfile
+import threading
+import time
+from typing import TYPE_CHECKING
 
+if TYPE_CHECKING:
+    import pandas
 
-logging.basicConfig(level=LOG_LEVEL)
+
+HISTORY_COLUMNS = ["idCountry", "idState", "idCity", "dailyCasesGrowth", "entranceDate"]
+INSERT_MODES = ["executemany", "multirow", "load_data"]
+
+
+def _rows(data, columns: list) -> list:
+    # batches are either lists of dicts or columnar pandas DataFrames; tolist() hands plain Python scalars to the driver
+    if isinstance(data, list):
+        return [tuple(d[c] for c in columns) for d in data]
+    return list(zip(*[data[c].tolist() for c in columns]))
 
 
 class MariaDBHandler(object):
 
-    def __init__(self, host: str, database: str, user: str, password: str):
+    def __init__(self, host: str, database: str, user: str, password: str, pool_size: int = None,
+                 connection_factory=None):
         self._host = host
         self._database = database
         self._user = user
         self._password = password
+        self._pool = ConnectionPool(connection_factory if connection_factory else self._connect,
+                                    pool_size if pool_size else DATABASE.get("pool_size"),
+                                    DATABASE.get("pool_timeout"))
+        self._session = threading.local()
+
+    @contextmanager
+    def session(self):
+        # every statement issued inside the block shares one pooled connection and one transaction, which is committed
+        #  when the block ends and rolled back if it raises. Nested sessions join the outermost one.
+        connection = getattr(self._session, "connection", None)
+        if connection:
+            yield connection
+            return
+        connection = self._pool.acquire()
+        self._session.connection = connection
+        broken = False
+        try:
+            yield connection
+            connection.commit()
+        except BaseException:
+            try:
+                connection.rollback()
+            except mariadb.Error:
+                broken = True
+            raise
+        finally:
+            self._session.connection = None
+            self._pool.release(connection, discard=broken)
 
-    def batch_insert(self, data: list):
-        if data:
+    def pool_stats(self) -> dict:
+        return self._pool.metrics.as_dict()
+
+    def close(self):
+        self._pool.close()
+
+    @timed("db_insert", rows=lambda inserted: inserted)
+    def batch_insert(self, data, mode: str = None) -> int:
+        if data is None or not len(data):
+            return 0
+        mode = mode if mode else DATABASE.get("insert_mode")
+        start = time.perf_counter()
+        if mode == "executemany":
             stmt = """INSERT INTO covid_cases_history (idCountry, idState, idCity, cases, entranceDate)
                            VALUES (%(idCountry)s, %(idState)s, %(idCity)s, %(dailyCasesGrowth)s, %(entranceDate)s)"""
-            self._batch_executor(stmt, data)
+            self._batch_executor(stmt, [dict(zip(HISTORY_COLUMNS, r)) for r in _rows(data, HISTORY_COLUMNS)])
+        elif mode == "multirow":
+            stmt = "INSERT INTO covid_cases_history (idCountry, idState, idCity, cases, entranceDate) VALUES"
+            self._multirow_executor(stmt, _rows(data, HISTORY_COLUMNS))
+        elif mode == "load_data":
+            if not DATABASE.get("allow_local_infile"):
+                raise ValueError("The 'load_data' insert mode needs DATABASE['allow_local_infile'] to be enabled.")
+            stmt = """LOAD DATA LOCAL INFILE %s INTO TABLE covid_cases_history
+                           FIELDS TERMINATED BY '\\t' LINES TERMINATED BY '\\n'
+                           (idCountry, idState, idCity, cases, entranceDate)"""
+            self._load_data_executor(stmt, _rows(data, HISTORY_COLUMNS))
+        else:
+            raise ValueError(f"Unknown insert mode '{mode}'. Expected one of {INSERT_MODES}.")
+        elapsed = time.perf_counter() - start
+        logging.info(f"Inserted {len(data)} rows into covid_cases_history using '{mode}' in {elapsed:.3f}s "
+                     f"({len(data) / elapsed if elapsed else float('inf'):.0f} rows/s).")
+        return len(data)
 
-    def batch_update(self, data: list):
-        if data:
+    @timed("db_update", rows=lambda affected: affected)
+    def batch_update(self, data, mode: str = None) -> int:
+        if data is None or not len(data):
+            return 0
+        mode = mode if mode else DATABASE.get("insert_mode")
+        start = time.perf_counter()
+        if mode == "executemany":
             stmt = """UPDATE covid_cases_history
                          SET cases = %(dailyCasesGrowth)s, entranceDate = %(entranceDate)s
                        WHERE idCity = %(idCity)s
                          AND entranceDate = %(entranceDateToUpdate)s"""
-            self._batch_executor(stmt, data)
+            update_columns = HISTORY_COLUMNS + ["entranceDateToUpdate"]
+            affected = self._batch_executor(stmt, [dict(zip(update_columns, r)) for r in _rows(data, update_columns)])
+        else:
+            # the new values are bulk loaded into a temporary staging table and applied with a single UPDATE ... JOIN.
+            #  Temporary tables are bound to a connection, hence everything runs inside one session (and transaction).
+            with self.session():
+                self._statement_executor("""CREATE TEMPORARY TABLE IF NOT EXISTS covid_cases_history_staging (
+                                                idCity INT NOT NULL,
+                                                cases INT NOT NULL,
+                                                entranceDate DATETIME NOT NULL,
+                                                entranceDateToUpdate DATETIME NOT NULL,
+                                                PRIMARY KEY (idCity, entranceDateToUpdate)
+                                            ) ENGINE=MEMORY""")
+                # a pooled connection may still hold the table of a previously failed update
+                self._statement_executor("DELETE FROM covid_cases_history_staging")
+                stmt = """INSERT INTO covid_cases_history_staging (idCity, cases, entranceDate, entranceDateToUpdate)
+                               VALUES"""
+                self._multirow_executor(stmt, _rows(data, ["idCity", "dailyCasesGrowth", "entranceDate",
+                                                           "entranceDateToUpdate"]))
+                affected = self._statement_executor("""UPDATE covid_cases_history h
+                                                         JOIN covid_cases_history_staging s
+                                                           ON h.idCity = s.idCity
+                                                          AND h.entranceDate = s.entranceDateToUpdate
+                                                          SET h.cases = s.cases, h.entranceDate = s.entranceDate""")
+                self._statement_executor("DROP TEMPORARY TABLE covid_cases_history_staging")
+        elapsed = time.perf_counter() - start
+        logging.info(f"Updated {affected} rows of covid_cases_history from {len(data)} values using '{mode}' in "
+                     f"{elapsed:.3f}s.")
+        return affected
 
     def get_latest_and_previous_entrance_date(self) -> tuple:
         query = "SELECT MAX(entranceDate) FROM covid_cases_history"
@@ -43,51 +151,125 @@ class MariaDBHandler(object):
             previous = records[0][0] if records[0][0] else None
         return previous, latest
 
-    def get_cases_by_entrance_date(self, entrance_date: datetime) -> pandas.io.sql:
-        query = """SELECT c.idCountry, c.idState, c.latitude, c.longitude, h.cases
-                     FROM cities c, covid_cases_history h
-                    WHERE c.idCity = h.idCity
-                      AND h.entranceDate = %(entrance_date)s"""
-        connection: mariadb.connector = None
+    def get_entrance_dates(self, start: datetime = None, end: datetime = None) -> list:
+        query = """SELECT DISTINCT entranceDate
+                     FROM covid_cases_history
+                    WHERE entranceDate >= %(start)s
+                      AND entranceDate < %(end)s
+                    ORDER BY entranceDate"""
+        records = self._query_executor(query, {"start": start if start else datetime.min,
+                                               "end": end if end else datetime.max})
+        return [r[0] for r in records]
+
+    def get_city_cases_by_entrance_date(self, entrance_date: datetime) -> "pandas.DataFrame":
+        query = """SELECT idCity, cases
+                     FROM covid_cases_history
+                    WHERE entranceDate = %(entrance_date)s"""
+        return self._read_sql(query, {"entrance_date": entrance_date})
+
+    def get_city_cases_by_entrance_dates(self, entrance_dates: list, chunk_size: int = 100) -> "pandas.DataFrame":
+        # only the rows of the given dates are fetched, `chunk_size` dates per query, so that a few scattered dates do
+        #  not pull in the whole history between them
+        import pandas
+        frames = []
+        with self.session():
+            for i in range(0, len(entrance_dates), chunk_size):
+                chunk = entrance_dates[i:i + chunk_size]
+                query = f"""SELECT entranceDate, idCity, cases
+                              FROM covid_cases_history
+                             WHERE entranceDate IN ({', '.join(['%s'] * len(chunk))})"""
+                frames.append(self._read_sql(query, chunk))
+        return pandas.concat(frames, ignore_index=True) if frames else pandas.DataFrame(
+            columns=["entranceDate", "idCity", "cases"])
+
+    def get_history_by_entrance_date_range(self, start: datetime, end: datetime) -> "pandas.DataFrame":
+        query = """SELECT idCountry, idState, idCity, cases AS dailyCasesGrowth, entranceDate
+                     FROM covid_cases_history
+                    WHERE entranceDate >= %(start)s
+                      AND entranceDate < %(end)s"""
+        return self._read_sql(query, {"start": start, "end": end})
+
+    def get_cities(self) -> "pandas.DataFrame":
+        query = "SELECT idCity, idCountry, idState, latitude, longitude FROM cities"
+        return self._read_sql(query)
+
+    def _connect(self):
+        return mariadb.connect(host=self._host, database=self._database, user=self._user, password=self._password,
+                               allow_local_infile=DATABASE.get("allow_local_infile"))
+
+    def _read_sql(self, query: str, params=None) -> "pandas.DataFrame":
+        # pandas is imported lazily so that the jobs which only check the database state start fast
+        import pandas
         try:
-            connection = mariadb.connect(
-                host=self._host, database=self._database, user=self._user, password=self._password)
-            return pandas.read_sql(query, con=connection, params={"entrance_date": entrance_date})
+            with self.session() as connection:
+                return pandas.read_sql(query, con=connection, params=params)
         except mariadb.Error as error:
             logging.error("Error reading data from MariaDB table.")
             raise error
-        finally:
-            if connection and connection.is_connected():
-                connection.close()
 
-    def _query_executor(self, query: str, data: tuple = None) -> list:
-        connection: mariadb.connector = None
+    def _query_executor(self, query: str, data=None) -> list:
         try:
-            connection = mariadb.connect(
-                host=self._host, database=self._database, user=self._user, password=self._password)
-            cursor = connection.cursor()
-            cursor.execute(query, data)
-            return cursor.fetchall()
+            with self.session() as connection:
+                cursor = connection.cursor()
+                try:
+                    cursor.execute(query, data)
+                    return cursor.fetchall()
+                finally:
+                    cursor.close()
         except mariadb.Error as error:
             logging.error("Error reading data from MariaDB table.")
             raise error
-        finally:
-            if connection and connection.is_connected():
-                connection.close()
-                cursor.close()
 
-    def _batch_executor(self, statement: str, data: list):
-        connection: mariadb.connector = None
+    def _statement_executor(self, statement: str, data=None) -> int:
         try:
-            connection = mariadb.connect(
-                host=self._host, database=self._database, user=self._user, password=self._password)
-            cursor = connection.cursor()
-            cursor.executemany(statement, data)
-            connection.commit()
+            with self.session() as connection:
+                cursor = connection.cursor()
+                try:
+                    cursor.execute(statement, data)
+                    return cursor.rowcount
+                finally:
+                    cursor.close()
+        except mariadb.Error as error:
+            logging.error("Failed to execute statement.")
+            raise error
+
+    def _batch_executor(self, statement: str, data: list) -> int:
+        try:
+            with self.session() as connection:
+                cursor = connection.cursor()
+                try:
+                    cursor.executemany(statement, data)
+                    return cursor.rowcount
+                finally:
+                    cursor.close()
         except mariadb.Error as error:
             logging.error("Failed to execute batch statement.")
             raise error
+
+    def _multirow_executor(self, statement: str, rows: list, chunk_size: int = None):
+        # `statement` ends with "VALUES" and one "(%s, ...)" group per row is appended to it, so each chunk of rows goes
+        #  to the server as a single multi-row statement
+        chunk_size = chunk_size if chunk_size else DATABASE.get("insert_chunk_size")
+        placeholders = f"({', '.join(['%s'] * len(rows[0]))})"
+        try:
+            with self.session() as connection:
+                cursor = connection.cursor()
+                try:
+                    for i in range(0, len(rows), chunk_size):
+                        chunk = rows[i:i + chunk_size]
+                        cursor.execute(f"{statement} {', '.join([placeholders] * len(chunk))}",
+                                       [value for row in chunk for value in row])
+                finally:
+                    cursor.close()
+        except mariadb.Error as error:
+            logging.error("Failed to execute multi-row statement.")
+            raise error
+
+    def _load_data_executor(self, statement: str, rows: list):
+        # the rows are streamed to a temporary TSV file whose name is bound to the single placeholder of `statement`
+        with tempfile.NamedTemporaryFile("w", suffix=".tsv", newline="", delete=False) as tsv_file:
+            csv.writer(tsv_file, delimiter="\t", lineterminator="\n").writerows(rows)
+        try:
+            self._statement_executor(statement, (tsv_file.name,))
         finally:
-            if connection and connection.is_connected():
-                connection.close()
-                cursor.close()
+            os.remove(tsv_file.name)
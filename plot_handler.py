@@ -1,107 +1,201 @@
 import geopandas as gpd
 import geoplot as gplt
+import json
 import logging
-import matplotlib.pyplot as plt
+import matplotlib
+import numpy
 import os
 import pandas
-from config import LOG_LEVEL
+import sys
+from aggregate_store import AggregateStore
+from city_cache import CityCache
+from concurrent.futures import ProcessPoolExecutor
+from config import PLOT
 from datetime import datetime
-from fs_handler import get_country_shape_file_path, get_state_shape_file_path, get_images_dst_filename
+from instrumentation import span, timed
+from fs_handler import get_country_shape_file_path, get_state_shape_file_path, get_output_filenames, images_rendered, \
+    state_name_to_initial
 from mariadb_handler import MariaDBHandler
-from shapely.geometry import Point
-from util import time_to_mdbstr
-
-
-logging.basicConfig(level=LOG_LEVEL)
-
-
-state_name_to_initial = {
-    "ACRE": "AC",
-    "ALAGOAS": "AL",
-    "AMAZONAS": "AM",
-    "AMAPÁ": "AP",
-    "BAHIA": "BA",
-    "CEARÁ": "CE",
-    "DISTRITO FEDERAL": "DF",
-    "ESPÍRITO SANTO": "ES",
-    "GOIÁS": "GO",
-    "MARANHÃO": "MA",
-    "MATO GROSSO": "MT",
-    "MATO GROSSO DO SUL": "MS",
-    "MINAS GERAIS": "MG",
-    "PARÁ": "PA",
-    "PARAÍBA": "PB",
-    "PERNAMBUCO": "PE",
-    "PIAUÍ": "PI",
-    "RIO DE JANEIRO": "RJ",
-    "RIO GRANDE DO NORTE": "RN",
-    "RIO GRANDE DO SUL": "RS",
-    "RONDÔNIA": "RO",
-    "RORAIMA": "RR",
-    "SANTA CATARINA": "SC",
-    "SÃO PAULO": "SP",
-    "SERGIPE": "SE",
-    "TOCANTINS": "TO",
-    "PARANÁ": "PR"
-}
-
-
-def _save_image(shape: gpd.GeoDataFrame, data: gpd.GeoDataFrame, output_file: str):
+from render_manifest import RenderManifest, link_output, remove_outputs
+from shape_cache import load_shape, rebuild_shapes
+from util import mdbstr_to_time, time_to_mdbstr
+
+# images are only ever written to files, so the non-interactive backend is selected before pyplot is loaded
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt  # noqa: E402
+
+
+def _save_image(shape: gpd.GeoDataFrame, data: gpd.GeoDataFrame, outputs: list):
+    # the figure is drawn once and saved at each (output_file, dpi) of `outputs`
     fig, ax = plt.subplots(figsize=(6, 6))
-    gplt.polyplot(shape, ax=ax, zorder=1)
-    gplt.pointplot(data, color="red", s=.5, ax=ax, zorder=2)
-    shape_bounds = shape.total_bounds
-    ax.set_ylim(shape_bounds[1], shape_bounds[3])
-    ax.set_xlim(shape_bounds[0], shape_bounds[2])
-    logging.info(f"Saving image to {output_file}")
-    plt.savefig(output_file, bbox_inches='tight', pad_inches=0.1, dpi=300)
-    # TODO: Solve "RuntimeWarning: More than 20 figures have been opened."
-    plt.clf()
+    try:
+        gplt.polyplot(shape, ax=ax, zorder=1)
+        gplt.pointplot(data, color="red", s=.5, ax=ax, zorder=2)
+        shape_bounds = shape.total_bounds
+        ax.set_ylim(shape_bounds[1], shape_bounds[3])
+        ax.set_xlim(shape_bounds[0], shape_bounds[2])
+        for output_file, dpi in outputs:
+            logging.info(f"Saving image to {output_file}")
+            fig.savefig(output_file, bbox_inches='tight', pad_inches=0.1, dpi=dpi)
+    finally:
+        plt.close(fig)
+
+
+def _save_geojson(xs, ys, output_file: str):
+    coordinates = numpy.column_stack((xs, ys)).round(5).tolist()
+    with open(output_file, "w") as f:
+        json.dump({"type": "Feature", "geometry": {"type": "MultiPoint", "coordinates": coordinates},
+                   "properties": {}}, f, separators=(",", ":"))
+
+
+def _render_image(shape_file: str, xs, ys, output_files: dict) -> list:
+    # runs inside a render worker: the shape comes from the worker's own geometry cache and only the points coordinates
+    #  are shipped from the parent process. `output_files` maps each output format to its file name.
+    remove_outputs(output_files)
+    if "points" in output_files:
+        numpy.save(output_files["points"], numpy.column_stack((xs, ys)).astype("f4"))
+    if "geojson" in output_files:
+        _save_geojson(xs, ys, output_files["geojson"])
+    images = [(output_files[output_format], PLOT.get(dpi)) for output_format, dpi in
+              [("png", "image_dpi"), ("thumbnail", "thumbnail_dpi")] if output_format in output_files]
+    if images:
+        shape = load_shape(shape_file)
+        _save_image(shape, gpd.GeoDataFrame(geometry=gpd.points_from_xy(xs, ys), crs=shape.crs), images)
+    return list(output_files.values())
+
+
+class ImageRenderer(object):
+
+    def __init__(self, workers: int = None):
+        self._workers: int = workers or PLOT.get("render_workers") or os.cpu_count() or 1
+        self._executor: ProcessPoolExecutor = None
+
+    def render(self, tasks: list) -> list:
+        # each task is a (shape_file, xs, ys, output_files) tuple
+        if not tasks:
+            return []
+        with span("render", rows=len(tasks)):
+            if self._workers <= 1:
+                return [_render_image(*t) for t in tasks]
+            if not self._executor:
+                self._executor = ProcessPoolExecutor(max_workers=self._workers)
+            return list(self._executor.map(_render_image, *zip(*tasks)))
+
+    def close(self):
+        if self._executor:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+@timed("spatial_filter", rows=len)
+def assign_states(points: gpd.GeoDataFrame, states_shape: gpd.GeoDataFrame) -> pandas.Series:
+    # a single indexed (R-tree) spatial join maps every point to the index of the state polygon it lies within. Points
+    #  outside every polygon are left out of the result, as the former per-state `contains` filter did.
+    joined = gpd.sjoin(points[["geometry"]], states_shape[["geometry"]], how="inner", op="within")
+    return joined["index_right"]
+
+
+def rebuild_shape_cache():
+    country_shape_file = get_country_shape_file_path()
+    rebuild_shapes([country_shape_file])
+    state_shape_files = [get_state_shape_file_path(state_name_to_initial.get(state['NM_ESTADO']), state['CD_GEOCUF'])
+                         for _, state in load_shape(country_shape_file).iterrows()]
+    rebuild_shapes(state_shape_files)
 
 
 class PlotHandler(object):
 
     def __init__(self, host: str = None, database: str = None, user: str = None, password: str = None,
-                 db_handler: MariaDBHandler = None):
+                 db_handler: MariaDBHandler = None, renderer: ImageRenderer = None, city_cache: CityCache = None,
+                 aggregates: AggregateStore = None, manifest: RenderManifest = None):
         if db_handler:
             self._db_handler = db_handler
         else:
             self._db_handler = MariaDBHandler(host, database, user, password)
+        self._renderer = renderer if renderer else ImageRenderer()
+        self._city_cache = city_cache if city_cache else CityCache(self._db_handler)
+        self._aggregates = aggregates if aggregates else AggregateStore()
+        self._manifest = manifest if manifest else RenderManifest()
 
-    def save_images(self, entrance_date: str):
+    def save_images(self, entrance_date: str, force: bool = False):
         df = self._create_df(entrance_date)
         if df.empty:
             logging.info(f"Empty result returned to the defined entrance_date ('{entrance_date}').")
         else:
-            brl_cases = gpd.GeoDataFrame(df)
-            brl_states_shape = gpd.read_file(get_country_shape_file_path())
-            _save_image(brl_states_shape, brl_cases, get_images_dst_filename(entrance_date, "BR"))
-            # TODO: Replace this naive implementation by something that performs better.
-            for state_idx, state in brl_states_shape.iterrows():
-                state_initials = state_name_to_initial.get(state['NM_ESTADO'])
-                state_shape = gpd.read_file(get_state_shape_file_path(state_initials, state['CD_GEOCUF']))
-                county_cases_filter = pandas.Series(
-                    map(lambda e: state["geometry"].contains(e[1]["geometry"]), brl_cases.iterrows()),
-                    brl_cases.index)
-                _save_image(state_shape, brl_cases[county_cases_filter],
-                            get_images_dst_filename(entrance_date, state_initials))
+            self._render(self._render_tasks(entrance_date, df), force)
+
+    def backfill(self, start: datetime = None, end: datetime = None, force: bool = False):
+        # renders every entrance date in [start, end) whose images are missing or older than the data; only the rows
+        #  of those dates are fetched and they are all rendered together by the renderer pool
+        entrance_dates = [time_to_mdbstr(ed) for ed in self._db_handler.get_entrance_dates(start, end)]
+        pending = entrance_dates if force else [ed for ed in entrance_dates if not images_rendered(ed)]
+        logging.info(f"{len(pending)} of {len(entrance_dates)} entrance dates need to be rendered.")
+        if not pending:
+            return
+        df = self._db_handler.get_city_cases_by_entrance_dates([mdbstr_to_time(ed) for ed in pending])
+        df["entranceDate"] = df["entranceDate"].map(lambda e: time_to_mdbstr(e.to_pydatetime()))
+        tasks = []
+        for entrance_date, date_df in df[df["entranceDate"].isin(pending)].groupby("entranceDate"):
+            date_df = _prepare_df(date_df.drop("entranceDate", axis=1).reset_index(drop=True),
+                                  self._city_cache.cities(), self._aggregates.rolling(entrance_date))
+            if date_df.empty:
+                logging.info(f"Empty result returned to the defined entrance_date ('{entrance_date}').")
+                continue
+            tasks.extend(self._render_tasks(entrance_date, date_df))
+        self._render(tasks, force)
+
+    def _render(self, tasks: list, force: bool = False):
+        # unchanged maps get the outputs of their previous render linked, once the changed ones are rendered
+        to_render, to_link = self._manifest.plan([(initials, shape_file, points.geometry.x.values,
+                                                   points.geometry.y.values, output_files)
+                                                  for initials, shape_file, points, output_files in tasks], force)
+        logging.info(f"{len(to_render)} of {len(tasks)} maps changed and will be rendered; the outputs of the "
+                     f"others are linked to their previous render.")
+        self._renderer.render(to_render)
+        for src, dst in to_link:
+            link_output(src, dst)
+        self._manifest.save()
+
+    def _render_tasks(self, entrance_date: str, df: pandas.DataFrame) -> list:
+        # each task is an (initials, shape_file, points, output_files) tuple
+        country_shape_file = get_country_shape_file_path()
+        brl_states_shape = load_shape(country_shape_file)
+        brl_cases = gpd.GeoDataFrame(df, crs=brl_states_shape.crs)
+        tasks = [("BR", country_shape_file, brl_cases, get_output_filenames(entrance_date, "BR"))]
+        cases_state_idx = assign_states(brl_cases, brl_states_shape)
+        cases_by_state = cases_state_idx.groupby(cases_state_idx).groups
+        for state_idx, state in brl_states_shape.iterrows():
+            state_initials = state_name_to_initial.get(state['NM_ESTADO'])
+            tasks.append((state_initials, get_state_shape_file_path(state_initials, state['CD_GEOCUF']),
+                          brl_cases.loc[cases_by_state.get(state_idx, [])],
+                          get_output_filenames(entrance_date, state_initials)))
+        return tasks
 
     def _create_df(self, entrance_date: datetime) -> pandas.DataFrame:
-        df = self._db_handler.get_cases_by_entrance_date(entrance_date)
-        if not df.empty:
-            df["geometry"] = [Point(xy) for xy in zip(df["longitude"], df["latitude"])]
-            df["rm_cases"] = df["cases"].rolling(window=3).mean()
-            df = df.query("rm_cases > 0")
-            return df.drop(["latitude", "longitude", "rm_cases"], axis=1)
-        return None
+        return _prepare_df(self._db_handler.get_city_cases_by_entrance_date(entrance_date), self._city_cache.cities(),
+                           self._aggregates.rolling(entrance_date))
+
+
+def _prepare_df(df: pandas.DataFrame, cities: gpd.GeoDataFrame,
+                rolling: pandas.DataFrame = None) -> pandas.DataFrame:
+    # only (idCity, cases) come from the database; the rest of the city attributes and its point geometry are aligned
+    #  from the city cache by idCity. The cities plotted are the ones whose 3 day rolling mean of new cases, taken from
+    #  the aggregates store, is positive; without aggregates for the date the new cases of the day are used instead.
+    if not df.empty:
+        df = df.join(cities, on="idCity", how="inner")
+        if rolling is not None:
+            df = df.join(rolling["rm3"], on="idCity", how="inner").query("rm3 > 0").drop(["rm3"], axis=1)
+        else:
+            df = df.query("cases > 0")
+    return df
 
 
 if __name__ == "__main__":
-    dbh = MariaDBHandler(host=os.environ.get("DB_HOST", "localhost"), database=os.environ.get("DB_NAME", "covid"),
-                         user=os.environ.get("DB_USER", "root"), password=os.environ.get("DB_PASS", "root"))
-    plh = PlotHandler(db_handler=dbh)
-    ed = dbh.get_latest_and_previous_entrance_date()[1]
-    if ed:
-        plh.save_images(time_to_mdbstr(ed))
-    else:
-        logging.info("Database appears to be empty. No 'entranceDate' retrieved.")
+    import cli
+    cli.main(["plot"] + sys.argv[1:])
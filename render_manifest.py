@@ -0,0 +1,85 @@
+import hashlib
+import json
+import numpy
+import os
+import shutil
+from config import PLOT
+from util import atomic_write
+
+
+def points_digest(shape_file: str, xs: numpy.ndarray, ys: numpy.ndarray) -> str:
+    # the points are hashed in coordinate order, so the same cities fetched in a different row order give the same
+    #  digest. The shape file mtime and the render settings change the output as well and are hashed along.
+    order = numpy.lexsort((ys, xs))
+    digest = hashlib.sha1(f"{os.path.abspath(shape_file)}|{os.stat(shape_file).st_mtime_ns}|"
+                          f"{PLOT.get('image_dpi')}|{PLOT.get('thumbnail_dpi')}|"
+                          f"{PLOT.get('shape_simplify_tolerance')}".encode("utf-8"))
+    digest.update(numpy.ascontiguousarray(numpy.asarray(xs, dtype="f8")[order]).tobytes())
+    digest.update(numpy.ascontiguousarray(numpy.asarray(ys, dtype="f8")[order]).tobytes())
+    return digest.hexdigest()
+
+
+def link_output(src: str, dst: str):
+    # an unchanged output is hard linked to the previous one (copied where the filesystem does not support links). Its
+    #  mtime is refreshed so that images_rendered sees it as written after the data entrance date.
+    if os.path.abspath(src) != os.path.abspath(dst):
+        tmp_filename = f"{dst}.{os.getpid()}.tmp"
+        try:
+            os.link(src, tmp_filename)
+        except OSError:
+            shutil.copy2(src, tmp_filename)
+        os.replace(tmp_filename, dst)
+    os.utime(dst)
+
+
+def remove_outputs(output_files: dict):
+    # an existing output may be a hard link shared with another date, so it is removed before being written again
+    #  instead of written over
+    for output_file in output_files.values():
+        if os.path.exists(output_file):
+            os.remove(output_file)
+
+
+class RenderManifest(object):
+    # on-disk record of the last render of each map (country or state initials): the digest of its points and the
+    #  files it was written to, by output format
+
+    def __init__(self, filename: str = None):
+        self._filename: str = filename if filename else PLOT.get("render_manifest_file")
+        self._entries: dict = self._load()
+
+    def previous_outputs(self, initials: str, digest: str) -> dict:
+        # output format -> file name of the last render of `initials` if it was made from the same points
+        entry = self._entries.get(initials)
+        return entry["outputs"] if entry and entry["digest"] == digest else {}
+
+    def record(self, initials: str, digest: str, output_files: dict):
+        self._entries[initials] = {"digest": digest, "outputs": output_files}
+
+    def plan(self, tasks: list, force: bool = False) -> tuple:
+        # splits the (initials, shape_file, xs, ys, output_files) tasks into the (shape_file, xs, ys, output_files) ones
+        #  to be rendered and the (src, dst) outputs to be linked. A map whose points digest matches the last render of
+        #  the same map gets the previous outputs linked instead of being drawn again. Tasks are planned in date order,
+        #  so during a backfill the previous outputs may be ones still to be written by the same plan; the links are
+        #  to be made only after those are rendered.
+        to_render, to_link, planned = [], [], set()
+        for initials, shape_file, xs, ys, output_files in tasks:
+            digest = points_digest(shape_file, xs, ys)
+            previous = {} if force else self.previous_outputs(initials, digest)
+            if all(previous.get(f) and (previous[f] in planned or os.path.exists(previous[f])) for f in output_files):
+                to_link.extend((previous[f], output_file) for f, output_file in output_files.items())
+            else:
+                to_render.append((shape_file, xs, ys, output_files))
+            planned.update(output_files.values())
+            self.record(initials, digest, output_files)
+        return to_render, to_link
+
+    def save(self):
+        atomic_write(self._filename, lambda f: json.dump(self._entries, f), "w")
+
+    def _load(self) -> dict:
+        try:
+            with open(self._filename) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
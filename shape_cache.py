@@ -0,0 +1,51 @@
+import functools
+import geopandas as gpd
+import hashlib
+import logging
+import os
+import pickle
+from config import PLOT
+from instrumentation import timed
+from util import atomic_write
+
+
+def _cache_filename(path: str, tolerance: float) -> str:
+    key = hashlib.sha1(f"{os.path.abspath(path)}|{tolerance}".encode("utf-8")).hexdigest()
+    return os.path.join(PLOT.get("shape_cache_path"), f"{key}.pickle")
+
+
+@timed("shapefile_parse")
+def _build_shape(path: str, mtime: int, tolerance: float) -> gpd.GeoDataFrame:
+    logging.info(f"Parsing shapefile {path}.")
+    shape = gpd.read_file(path)
+    if tolerance:
+        shape["geometry"] = shape.geometry.simplify(tolerance, preserve_topology=True)
+    atomic_write(_cache_filename(path, tolerance),
+                 lambda f: pickle.dump((mtime, shape), f, protocol=pickle.HIGHEST_PROTOCOL))
+    return shape
+
+
+@functools.lru_cache(maxsize=64)
+def _load_shape(path: str, mtime: int, tolerance: float) -> gpd.GeoDataFrame:
+    try:
+        with open(_cache_filename(path, tolerance), "rb") as f:
+            cached_mtime, shape = pickle.load(f)
+        if cached_mtime == mtime:
+            return shape
+    except (OSError, EOFError, pickle.UnpicklingError):
+        pass
+    return _build_shape(path, mtime, tolerance)
+
+
+@timed("shapefile_load")
+def load_shape(path: str, tolerance: float = None) -> gpd.GeoDataFrame:
+    # the returned GeoDataFrame is shared by every caller in the process and must be treated as read only
+    tolerance = tolerance if tolerance is not None else PLOT.get("shape_simplify_tolerance")
+    return _load_shape(path, os.stat(path).st_mtime_ns, tolerance)
+
+
+def rebuild_shapes(paths: list, tolerance: float = None):
+    tolerance = tolerance if tolerance is not None else PLOT.get("shape_simplify_tolerance")
+    _load_shape.cache_clear()
+    for path in paths:
+        _build_shape(path, os.stat(path).st_mtime_ns, tolerance)
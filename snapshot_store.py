@@ -0,0 +1,43 @@
+import numpy
+import os
+from config import SNAPSHOTS_PATH
+from datetime import datetime
+from instrumentation import timed
+from fs_handler import datetime_from_filename, get_data_from_csv
+from util import atomic_write, fsstr_to_time, time_to_fsstr
+
+
+class SnapshotStore(object):
+    # columnar store of the parsed ZIP files: one CASES_DTYPE .npy file per ZIP datetime, partitioned by day
+    #  (<path>/<YYYY-MM-DD>/<datetime>.npy) and memory mapped when read
+
+    def __init__(self, path: str = None):
+        self._path: str = path if path else SNAPSHOTS_PATH
+
+    @timed("snapshot_load", rows=len)
+    def get(self, zip_filename: str) -> numpy.ndarray:
+        snapshot_filename = self._filename(datetime_from_filename(zip_filename))
+        # a snapshot is still valid when the ZIP file is gone or has not been touched since the snapshot was written
+        if os.path.exists(snapshot_filename) and (
+                not os.path.exists(zip_filename) or
+                os.path.getmtime(snapshot_filename) >= os.path.getmtime(zip_filename)):
+            return numpy.load(snapshot_filename, mmap_mode="r")
+        data = get_data_from_csv(zip_filename)
+        self.put(datetime_from_filename(zip_filename), data)
+        return data
+
+    def put(self, file_datetime: datetime, data: numpy.ndarray):
+        atomic_write(self._filename(file_datetime), lambda f: numpy.save(f, data))
+
+    def datetimes(self) -> list:
+        if not os.path.isdir(self._path):
+            return []
+        return sorted(fsstr_to_time(os.path.splitext(f)[0]) for d in os.listdir(self._path)
+                      for f in os.listdir(os.path.join(self._path, d)) if f.endswith(".npy"))
+
+    def _filename(self, file_datetime: datetime) -> str:
+        return os.path.join(self._path, file_datetime.strftime("%Y-%m-%d"), f"{time_to_fsstr(file_datetime)}.npy")
+
+
+def load_snapshot(zip_filename: str) -> numpy.ndarray:
+    return SnapshotStore().get(zip_filename)
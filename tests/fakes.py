@@ -0,0 +1,57 @@
+class FakeCursor(object):
+    def __init__(self, connection):
+        self._connection = connection
+        self.rowcount = 0
+
+    def execute(self, statement, data=None):
+        self._connection.statements.append((" ".join(statement.split()), data))
+        self.rowcount = self._connection.rowcount
+
+    def executemany(self, statement, data):
+        self._connection.statements.append((" ".join(statement.split()), list(data)))
+        self.rowcount = self._connection.rowcount
+
+    def fetchall(self):
+        return self._connection.rows
+
+    def close(self):
+        pass
+
+
+class FakeConnection(object):
+    # records the statements, commits and rollbacks issued through it
+    def __init__(self, rowcount: int = 0, rows: list = None):
+        self.rowcount = rowcount
+        self.rows = rows if rows is not None else [(None,)]
+        self.statements = []
+        self.commits = 0
+        self.rollbacks = 0
+        self.closed = False
+        self.connected = True
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = True
+
+    def is_connected(self):
+        return self.connected
+
+
+class FakeConnectionFactory(object):
+    def __init__(self, rowcount: int = 0, rows: list = None):
+        self.rowcount = rowcount
+        self.rows = rows
+        self.connections = []
+
+    def __call__(self):
+        connection = FakeConnection(self.rowcount, self.rows)
+        self.connections.append(connection)
+        return connection
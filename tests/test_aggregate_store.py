@@ -0,0 +1,86 @@
+import numpy
+import pandas
+import pytest
+from aggregate_store import AggregateStore
+from cases_diff import GROWTH_COLUMNS
+from fakes import FakeConnectionFactory
+from lstm_dao import LstmDao
+
+
+def _batch(entrance_date: str, growths: list) -> pandas.DataFrame:
+    # one row per city, cities 1 and 2 in state 1 and city 3 in state 2
+    return pandas.DataFrame({"idCountry": 1, "idState": [1, 1, 2], "idCity": [1, 2, 3], "dailyCasesGrowth": growths,
+                             "entranceDate": entrance_date}, columns=GROWTH_COLUMNS)
+
+
+@pytest.fixture
+def store(tmp_path) -> AggregateStore:
+    return AggregateStore(str(tmp_path / "aggregates"))
+
+
+def test_totals_and_rolling_means(store):
+    for day, growths in enumerate([[1, 2, 3], [3, 4, 5], [5, 6, 7], [7, 8, 9]], start=1):
+        store.update(_batch(f"2020-06-0{day} 22:00:00", growths))
+    assert store.state_totals().loc["2020-06-04 22:00:00"].tolist() == [15, 9]
+    assert store.country_totals()[1].tolist() == [6, 12, 18, 24]
+    rolling = store.rolling("2020-06-04 22:00:00")
+    assert rolling.loc[1, "rm3"] == pytest.approx(5)
+    assert rolling.loc[1, "rm7"] == pytest.approx(4)
+
+
+def test_same_day_update_replaces_the_previous_values(store):
+    store.update(_batch("2020-06-01 22:00:00", [1, 2, 3]))
+    store.update(_batch("2020-06-02 08:00:00", [100, 100, 100]))
+    store.update(_batch("2020-06-02 22:00:00", [3, 4, 5]), replaces="2020-06-02 08:00:00")
+    assert store.country_totals().index.tolist() == ["2020-06-01 22:00:00", "2020-06-02 22:00:00"]
+    assert store.state_totals().loc["2020-06-02 22:00:00"].tolist() == [7, 5]
+    assert store.rolling("2020-06-02 22:00:00").loc[1, "rm7"] == pytest.approx(2)
+
+
+def test_store_is_persisted_and_rebuild_matches_the_incremental_updates(store, tmp_path):
+    batches = [_batch(f"2020-06-0{day} 22:00:00", list(numpy.arange(3) + day)) for day in range(1, 4)]
+    for batch in batches:
+        store.update(batch)
+    rebuilt = AggregateStore(str(tmp_path / "rebuilt"))
+    rebuilt.rebuild(pandas.concat(batches))
+    reloaded = AggregateStore(store._path)
+    pandas.testing.assert_frame_equal(reloaded.state_totals(), rebuilt.state_totals())
+    pandas.testing.assert_frame_equal(reloaded.rolling("2020-06-03 22:00:00"), rebuilt.rolling("2020-06-03 22:00:00"))
+
+
+def test_region_series(store):
+    assert store.region_series("state") is None
+    store.update(_batch("2020-06-01 22:00:00", [1, 2, 3]))
+    store.update(_batch("2020-06-02 22:00:00", [3, 4, 5]))
+    series = store.region_series("state")
+    assert series.columns.tolist() == ["idRegion", "entranceDate", "cases"]
+    assert series["idRegion"].tolist() == [1, 1, 2, 2]
+    assert series["cases"].tolist() == [3, 7, 3, 5]
+    assert series["entranceDate"].iloc[1] == pandas.Timestamp("2020-06-02 22:00:00")
+    assert store.region_series("country")["cases"].tolist() == [6, 12]
+
+
+def _dao(first: str, last: str) -> LstmDao:
+    # a DAO over a history spanning [first, last] whose SQL series reads are recorded instead of run
+    factory = FakeConnectionFactory(rows=[(pandas.Timestamp(first).to_pydatetime(),
+                                           pandas.Timestamp(last).to_pydatetime())])
+    dao = LstmDao("localhost", "covid", "user", "password", connection_factory=factory)
+    dao.sql_reads = []
+    dao._read_sql = lambda query, params=None: dao.sql_reads.append(query) or "sql"
+    return dao
+
+
+def test_lstm_dao_reads_the_region_series_from_the_store(store):
+    store.update(_batch("2020-06-01 22:00:00", [1, 2, 3]))
+    store.update(_batch("2020-06-02 22:00:00", [3, 4, 5]))
+    dao = _dao("2020-06-01 22:00:00", "2020-06-02 22:00:00")
+    assert dao.get_cases_series_by_region("country", store)["cases"].tolist() == [6, 12]
+    assert dao.sql_reads == []
+
+
+def test_lstm_dao_falls_back_to_sql_when_the_store_misses_dates(store):
+    # e.g. an existing history whose aggregates only started with the latest ingest
+    store.update(_batch("2020-06-02 22:00:00", [3, 4, 5]))
+    dao = _dao("2020-06-01 22:00:00", "2020-06-02 22:00:00")
+    assert dao.get_cases_series_by_region("state", store) == "sql"
+    assert len(dao.sql_reads) == 1
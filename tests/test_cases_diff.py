@@ -0,0 +1,58 @@
+import numpy
+import pytest
+from cases_diff import DailyGrowthReducer, compute_daily_growth
+from fs_handler import CASES_DTYPE
+
+
+def _snapshots(files: int = 8, cities: int = 50, seed: int = 3) -> list:
+    # cumulative cases of a random subset of the cities per file, so cities go missing and appear late
+    rnd = numpy.random.RandomState(seed)
+    cases = numpy.zeros(cities, dtype="i4")
+    snapshots = []
+    for i in range(files):
+        cases = cases + rnd.randint(0, 20, cities).astype("i4")
+        present = numpy.nonzero(rnd.rand(cities) < 0.8)[0]
+        data = numpy.zeros(present.size, dtype=CASES_DTYPE)
+        data["idCountry"], data["idState"], data["idCity"], data["cases"] = 1, present % 5 + 1, present + 1, \
+            cases[present]
+        rnd.shuffle(data)
+        snapshots.append((f"2020-06-{i + 1:02d} 22:00:00", data))
+    return snapshots
+
+
+def _dict_loop(snapshots: list) -> list:
+    # the per-row loop the ingestion used before the vectorized diff
+    cur_data, batches = {}, []
+    for entrance_date, new_data in snapshots:
+        db_data = []
+        for id_country, id_state, id_city, cases in new_data.tolist():
+            if id_city not in cur_data:
+                cur_data[id_city] = {"idCountry": id_country, "idState": id_state, "cases": cases}
+                continue
+            db_data.append((id_country, id_state, id_city, cases - cur_data[id_city]["cases"], entrance_date))
+            cur_data[id_city]["cases"] = cases
+        batches.append(sorted(db_data))
+    return batches
+
+
+def _rows(batch) -> list:
+    return sorted(map(tuple, batch[["idCountry", "idState", "idCity", "dailyCasesGrowth", "entranceDate"]]
+                      .values.tolist()))
+
+
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_vectorized_diff_matches_the_dict_loop(seed):
+    snapshots = _snapshots(seed=seed)
+    assert [_rows(b) for b in compute_daily_growth(snapshots)] == _dict_loop(snapshots)
+
+
+def test_reducer_matches_the_vectorized_diff():
+    snapshots = _snapshots()
+    reducer = DailyGrowthReducer()
+    assert [_rows(reducer.reduce(ed, data)) for ed, data in snapshots] == \
+        [_rows(b) for b in compute_daily_growth(snapshots)]
+
+
+def test_first_snapshot_has_no_growth():
+    assert compute_daily_growth([]) == []
+    assert compute_daily_growth(_snapshots(files=1))[0].empty
@@ -0,0 +1,63 @@
+import pytest
+import threading
+from db_pool import ConnectionPool, PoolExhaustedError
+from fakes import FakeConnectionFactory
+
+
+def test_idle_connection_is_reused():
+    factory = FakeConnectionFactory()
+    pool = ConnectionPool(factory, size=2, timeout=1)
+    connection = pool.acquire()
+    pool.release(connection)
+    assert pool.acquire() is connection
+    assert len(factory.connections) == 1
+    assert pool.metrics.as_dict()["reused"] == 1
+
+
+def test_dead_connection_is_replaced():
+    factory = FakeConnectionFactory()
+    pool = ConnectionPool(factory, size=1, timeout=1)
+    connection = pool.acquire()
+    pool.release(connection)
+    connection.connected = False
+    assert pool.acquire() is not connection
+    assert connection.closed
+    assert pool.metrics.discarded == 1
+
+
+def test_acquire_times_out_when_exhausted():
+    pool = ConnectionPool(FakeConnectionFactory(), size=1, timeout=0.05)
+    pool.acquire()
+    with pytest.raises(PoolExhaustedError):
+        pool.acquire()
+
+
+def test_released_slot_unblocks_a_waiter():
+    pool = ConnectionPool(FakeConnectionFactory(), size=1, timeout=5)
+    connection = pool.acquire()
+    acquired = []
+    waiter = threading.Thread(target=lambda: acquired.append(pool.acquire()))
+    waiter.start()
+    pool.release(connection)
+    waiter.join(5)
+    assert acquired == [connection]
+
+
+def test_discarded_connection_is_closed():
+    pool = ConnectionPool(FakeConnectionFactory(), size=1, timeout=1)
+    connection = pool.acquire()
+    pool.release(connection, discard=True)
+    assert connection.closed
+    assert pool.acquire() is not connection
+
+
+def test_liveness_is_checked_on_acquire_only():
+    checks = []
+    factory = FakeConnectionFactory()
+    pool = ConnectionPool(factory, size=1, timeout=1)
+    connection = pool.acquire()
+    connection.is_connected = lambda: checks.append("ping") or True
+    pool.release(connection)
+    assert checks == []
+    assert pool.acquire() is connection
+    assert checks == ["ping"]
@@ -0,0 +1,83 @@
+import fs_handler
+import os
+import pytest
+from config import CSV_FILENAME
+from datetime import datetime
+from fs_handler import FSHandler
+from zipfile import ZipFile
+
+
+def _write_zip(path: str, file_dt: datetime, cases: int = 1) -> str:
+    filename = os.path.join(path, f"csv_dados_{file_dt.strftime('%d_%m_%Y-%H_%M_%S')}.zip")
+    with ZipFile(filename, "w") as zip_obj:
+        zip_obj.writestr(CSV_FILENAME, f'"idCountry","idState","idCity","confirmed","lastUpdate"\n1,1,1,{cases},"x"\n')
+    return filename
+
+
+@pytest.fixture
+def csv_path(tmp_path, monkeypatch) -> str:
+    monkeypatch.setattr(fs_handler, "CSV_MANIFEST_PATH", str(tmp_path / "manifest"))
+    path = tmp_path / "csv"
+    path.mkdir()
+    return str(path)
+
+
+def _names(files: list) -> list:
+    return [os.path.basename(f) for f in files]
+
+
+def test_only_the_latest_file_of_each_day_is_processed(csv_path):
+    for file_dt in [datetime(2020, 5, 31, 5, 0, 2), datetime(2020, 5, 31, 22, 59, 1), datetime(2020, 6, 1, 22, 0, 0),
+                    datetime(2020, 6, 1, 8, 0, 0)]:
+        _write_zip(csv_path, file_dt)
+    assert _names(FSHandler(csv_path).get_files_to_process()) == ["csv_dados_31_05_2020-22_59_01.zip",
+                                                                  "csv_dados_01_06_2020-22_00_00.zip"]
+
+
+def test_the_last_processed_file_is_the_baseline(csv_path):
+    for day in range(1, 4):
+        _write_zip(csv_path, datetime(2020, 6, day, 22, 0, 0))
+    files = FSHandler(csv_path, datetime(2020, 6, 1, 22, 0, 0), datetime(2020, 6, 2, 22, 0, 0)).get_files_to_process()
+    assert _names(files) == ["csv_dados_02_06_2020-22_00_00.zip", "csv_dados_03_06_2020-22_00_00.zip"]
+
+
+def test_same_day_update_is_diffed_against_the_previous_day(csv_path):
+    _write_zip(csv_path, datetime(2020, 6, 1, 22, 0, 0))
+    _write_zip(csv_path, datetime(2020, 6, 2, 8, 0, 0), cases=1)
+    _write_zip(csv_path, datetime(2020, 6, 2, 22, 0, 0), cases=2)
+    files = FSHandler(csv_path, datetime(2020, 6, 1, 22, 0, 0), datetime(2020, 6, 2, 8, 0, 0)).get_files_to_process()
+    assert _names(files) == ["csv_dados_01_06_2020-22_00_00.zip", "csv_dados_02_06_2020-22_00_00.zip"]
+
+
+def test_same_day_update_with_identical_content_is_skipped(csv_path):
+    _write_zip(csv_path, datetime(2020, 6, 1, 22, 0, 0))
+    _write_zip(csv_path, datetime(2020, 6, 2, 8, 0, 0), cases=2)
+    _write_zip(csv_path, datetime(2020, 6, 2, 22, 0, 0), cases=2)
+    assert FSHandler(csv_path, datetime(2020, 6, 1, 22, 0, 0), datetime(2020, 6, 2, 8, 0, 0)).get_files_to_process() \
+        == []
+
+
+def test_file_index_rehashes_only_changed_files(csv_path):
+    filename = _write_zip(csv_path, datetime(2020, 6, 1, 22, 0, 0))
+    index = fs_handler.FileIndex(csv_path)
+    digest = index.refresh()[os.path.basename(filename)]["sha1"]
+    _write_zip(csv_path, datetime(2020, 6, 1, 22, 0, 0), cases=5)
+    os.utime(filename, ns=(0, 0))
+    assert fs_handler.FileIndex(csv_path).refresh()[os.path.basename(filename)]["sha1"] != digest
+
+
+def test_unchanged_directory_is_not_listed(csv_path, monkeypatch):
+    _write_zip(csv_path, datetime(2020, 6, 1, 22, 0, 0))
+    os.utime(csv_path, ns=(10 ** 18, 10 ** 18))
+    FSHandler(csv_path)
+
+    def fail(*args):
+        raise AssertionError("the directory or the full manifest was read")
+
+    monkeypatch.setattr(fs_handler.os, "scandir", fail)
+    monkeypatch.setattr(fs_handler.FileIndex, "_load_entries", fail)
+    assert len(FSHandler(csv_path).get_files_to_process()) == 1
+    monkeypatch.undo()
+    monkeypatch.setattr(fs_handler, "CSV_MANIFEST_PATH", os.path.join(os.path.dirname(csv_path), "manifest"))
+    _write_zip(csv_path, datetime(2020, 6, 2, 22, 0, 0))
+    assert len(FSHandler(csv_path).get_files_to_process()) == 2
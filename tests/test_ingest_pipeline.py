@@ -0,0 +1,52 @@
+import instrumentation
+import numpy
+import os
+import pytest
+from cases_diff import compute_daily_growth
+from config import CSV_FILENAME
+from fs_handler import get_data_from_csv
+from ingest_pipeline import run_pipeline
+from zipfile import ZipFile
+
+
+@pytest.fixture
+def zip_files(tmp_path) -> list:
+    rnd = numpy.random.RandomState(5)
+    cases = numpy.zeros(30, dtype="i4")
+    files = []
+    for day in range(1, 6):
+        cases = cases + rnd.randint(0, 9, cases.size).astype("i4")
+        lines = ['"idCountry","idState","idCity","confirmed","lastUpdate"']
+        lines.extend(f'1,{i % 3 + 1},{i + 1},{c},"x"' for i, c in enumerate(cases))
+        filename = os.path.join(str(tmp_path), f"csv_dados_{day:02d}_06_2020-22_00_00.zip")
+        with ZipFile(filename, "w") as zip_obj:
+            zip_obj.writestr(CSV_FILENAME, "\n".join(lines) + "\n")
+        files.append(filename)
+    return files
+
+
+def test_pipeline_writes_the_batches_of_the_vectorized_diff(zip_files):
+    written = []
+    run_pipeline(zip_files, lambda file, batch: written.append((file, batch)), workers=2, queue_depth=1)
+    expected = [b for b in compute_daily_growth([(str(i), get_data_from_csv(f)) for i, f in enumerate(zip_files)])
+                if not b.empty]
+    assert [f for f, _ in written] == zip_files[1:]
+    for (_, batch), expected_batch in zip(written, expected):
+        assert batch.sort_values("idCity")["dailyCasesGrowth"].tolist() == \
+            expected_batch.sort_values("idCity")["dailyCasesGrowth"].tolist()
+
+
+def test_pipeline_records_the_decode_wait(zip_files):
+    instrumentation.reset()
+    run_pipeline(zip_files, lambda file, batch: None, workers=2, queue_depth=1)
+    stats = instrumentation.snapshot()["spans"]["zip_decode"]
+    assert stats["calls"] == len(zip_files)
+    assert stats["rows"] == 30 * len(zip_files)
+
+
+def test_pipeline_raises_the_writer_error(zip_files):
+    def write_batch(file, batch):
+        raise RuntimeError(file)
+
+    with pytest.raises(RuntimeError):
+        run_pipeline(zip_files, write_batch, workers=2, queue_depth=1)
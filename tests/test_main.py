@@ -0,0 +1,50 @@
+import aggregate_store
+import main
+import pandas
+import pytest
+from aggregate_store import AggregateStore
+from datetime import datetime
+
+
+class _History(object):
+    # a database handler holding a fixed covid_cases_history and no new file to ingest
+    def __init__(self, history: pandas.DataFrame):
+        self._history = history
+        self.history_reads = 0
+
+    def get_latest_and_previous_entrance_date(self) -> tuple:
+        dates = sorted(self._history["entranceDate"].unique())
+        return dates[-2].to_pydatetime(), dates[-1].to_pydatetime()
+
+    def get_history_by_entrance_date_range(self, start: datetime, end: datetime) -> pandas.DataFrame:
+        self.history_reads += 1
+        return self._history.copy()
+
+
+class _NoFiles(object):
+    def get_files_to_process(self) -> list:
+        return []
+
+
+@pytest.fixture
+def history(tmp_path, monkeypatch) -> _History:
+    monkeypatch.setattr(aggregate_store, "AGGREGATES_PATH", str(tmp_path))
+    return _History(pandas.DataFrame({
+        "idCountry": 1, "idState": [1, 1, 1, 1], "idCity": [1, 2, 1, 2], "dailyCasesGrowth": [1, 2, 3, 4],
+        "entranceDate": pandas.to_datetime(["2020-06-01 22:00", "2020-06-01 22:00", "2020-06-02 22:00",
+                                            "2020-06-02 22:00"])}))
+
+
+def test_ingest_rebuilds_aggregates_behind_the_history(history):
+    # e.g. the store missed the update of 2020-06-02 after its write to the history was committed
+    AggregateStore().update(history._history.iloc[:2].assign(entranceDate="2020-06-01 22:00:00"))
+    main.ingest(history, pipelined=False, fs_handler=_NoFiles())
+    assert history.history_reads == 1
+    assert AggregateStore().last_entrance_date() == "2020-06-02 22:00:00"
+    assert AggregateStore().country_totals()[1].tolist() == [3, 7]
+
+
+def test_ingest_keeps_aggregates_in_step_with_the_history(history):
+    main.rebuild_aggregates(history)
+    main.ingest(history, pipelined=False, fs_handler=_NoFiles())
+    assert history.history_reads == 1
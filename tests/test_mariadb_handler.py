@@ -0,0 +1,110 @@
+import os
+import pytest
+from config import DATABASE
+from fakes import FakeConnectionFactory, FakeCursor
+from mariadb_handler import MariaDBHandler
+
+
+def _handler(factory: FakeConnectionFactory, pool_size: int = 2) -> MariaDBHandler:
+    return MariaDBHandler("localhost", "covid", "user", "password", pool_size=pool_size, connection_factory=factory)
+
+
+def test_session_commits_on_success():
+    factory = FakeConnectionFactory()
+    with _handler(factory).session() as connection:
+        pass
+    assert connection.commits == 1
+    assert connection.rollbacks == 0
+
+
+def test_session_rolls_back_on_exception():
+    factory = FakeConnectionFactory()
+    with pytest.raises(RuntimeError):
+        with _handler(factory).session():
+            raise RuntimeError()
+    connection = factory.connections[0]
+    assert connection.commits == 0
+    assert connection.rollbacks == 1
+
+
+def test_nested_sessions_join_the_outer_connection():
+    factory = FakeConnectionFactory()
+    handler = _handler(factory)
+    with handler.session() as outer:
+        with handler.session() as inner:
+            assert inner is outer
+        handler.get_latest_and_previous_entrance_date()
+        assert outer.commits == 0
+    assert len(factory.connections) == 1
+    assert outer.commits == 1
+
+
+def test_statements_outside_a_session_reuse_the_pooled_connection():
+    factory = FakeConnectionFactory()
+    handler = _handler(factory)
+    for _ in range(3):
+        handler.get_latest_and_previous_entrance_date()
+    stats = handler.pool_stats()
+    assert len(factory.connections) == 1
+    assert stats["acquisitions"] == 3
+    assert stats["created"] == 1
+    assert stats["reused"] == 2
+    assert stats["reuse_ratio"] == pytest.approx(2 / 3)
+
+
+def test_close_discards_the_idle_connections():
+    factory = FakeConnectionFactory()
+    handler = _handler(factory)
+    handler.get_latest_and_previous_entrance_date()
+    handler.close()
+    assert factory.connections[0].closed
+    assert handler.pool_stats()["discarded"] == 1
+
+
+@pytest.mark.parametrize("mode", ["executemany", "multirow"])
+def test_batch_update_reports_the_rows_changed(mode):
+    # the server changed 3 of the 5 rows sent
+    handler = _handler(FakeConnectionFactory(rowcount=3))
+    data = [{"idCountry": 1, "idState": 1, "idCity": i, "dailyCasesGrowth": i, "entranceDate": "2020-06-02 22:00:00",
+             "entranceDateToUpdate": "2020-06-02 18:00:00"} for i in range(5)]
+    assert handler.batch_update(data, mode=mode) == 3
+
+
+def _history(rows: int) -> list:
+    return [{"idCountry": 1, "idState": 1, "idCity": i, "dailyCasesGrowth": i, "entranceDate": "2020-06-02 22:00:00"}
+            for i in range(rows)]
+
+
+def test_multirow_insert_sends_one_statement_per_chunk(monkeypatch):
+    monkeypatch.setitem(DATABASE, "insert_chunk_size", 4)
+    factory = FakeConnectionFactory()
+    assert _handler(factory).batch_insert(_history(10), mode="multirow") == 10
+    statements = factory.connections[0].statements
+    assert [len(data) for _, data in statements] == [4 * 5, 4 * 5, 2 * 5]
+    assert [statement.count("(%s, %s, %s, %s, %s)") for statement, _ in statements] == [4, 4, 2]
+    assert statements[-1][1][:5] == [1, 1, 8, 8, "2020-06-02 22:00:00"]
+
+
+def test_load_data_sends_a_tsv_of_the_rows_and_removes_it(monkeypatch):
+    monkeypatch.setitem(DATABASE, "allow_local_infile", True)
+    files = []
+
+    class Cursor(FakeCursor):
+        def execute(self, statement, data=None):
+            with open(data[0]) as f:
+                files.append((data[0], f.read()))
+            super(Cursor, self).execute(statement, data)
+
+    factory = FakeConnectionFactory()
+    handler = _handler(factory)
+    with handler.session() as connection:
+        connection.cursor = lambda: Cursor(connection)
+        handler.batch_insert(_history(2), mode="load_data")
+    (filename, content), = files
+    assert content == "1\t1\t0\t0\t2020-06-02 22:00:00\n1\t1\t1\t1\t2020-06-02 22:00:00\n"
+    assert not os.path.exists(filename)
+
+
+def test_load_data_needs_local_infile_enabled():
+    with pytest.raises(ValueError):
+        _handler(FakeConnectionFactory()).batch_insert(_history(1), mode="load_data")
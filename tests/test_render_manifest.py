@@ -0,0 +1,69 @@
+import numpy
+import pytest
+from render_manifest import RenderManifest, link_output, points_digest, remove_outputs
+
+
+@pytest.fixture
+def shape_file(tmp_path) -> str:
+    filename = str(tmp_path / "BR.shp")
+    with open(filename, "wb") as f:
+        f.write(b"shape")
+    return filename
+
+
+def _write(filename: str, content: bytes):
+    with open(filename, "wb") as f:
+        f.write(content)
+
+
+def _read(filename: str) -> bytes:
+    with open(filename, "rb") as f:
+        return f.read()
+
+
+def _task(shape_file: str, path, entrance_date: str, xs: list, ys: list) -> tuple:
+    return "BR", shape_file, numpy.array(xs, dtype="f8"), numpy.array(ys, dtype="f8"), \
+        {"png": str(path / f"BR_{entrance_date}.png")}
+
+
+def test_the_digest_does_not_depend_on_the_row_order(shape_file):
+    xs, ys = numpy.array([-46.6, -43.2, -47.9, -43.2]), numpy.array([-23.5, -22.9, -15.8, -19.9])
+    order = numpy.array([2, 0, 3, 1])
+    assert points_digest(shape_file, xs, ys) == points_digest(shape_file, xs[order], ys[order])
+    assert points_digest(shape_file, xs, ys) != points_digest(shape_file, xs[:3], ys[:3])
+
+
+def test_a_rerender_does_not_modify_the_linked_output(tmp_path):
+    previous, current = str(tmp_path / "BR_2020-06-01.png"), str(tmp_path / "BR_2020-06-02.png")
+    _write(previous, b"first")
+    link_output(previous, current)
+    assert _read(current) == b"first"
+    remove_outputs({"png": current})
+    _write(current, b"second")
+    assert _read(previous) == b"first"
+    assert _read(current) == b"second"
+
+
+def test_an_unchanged_map_is_linked_and_not_rendered(shape_file, tmp_path):
+    manifest = RenderManifest(str(tmp_path / "manifest.json"))
+    first = _task(shape_file, tmp_path, "2020-06-01", [-46.6, -43.2], [-23.5, -22.9])
+    to_render, to_link = manifest.plan([first])
+    assert [t[3] for t in to_render] == [first[4]] and to_link == []
+    _write(first[4]["png"], b"first")
+    manifest.save()
+
+    manifest = RenderManifest(str(tmp_path / "manifest.json"))
+    unchanged = _task(shape_file, tmp_path, "2020-06-02", [-43.2, -46.6], [-22.9, -23.5])
+    changed = _task(shape_file, tmp_path, "2020-06-03", [-43.2], [-22.9])
+    to_render, to_link = manifest.plan([unchanged, changed])
+    assert to_link == [(first[4]["png"], unchanged[4]["png"])]
+    assert [t[3] for t in to_render] == [changed[4]]
+
+
+def test_force_renders_an_unchanged_map(shape_file, tmp_path):
+    manifest = RenderManifest(str(tmp_path / "manifest.json"))
+    first = _task(shape_file, tmp_path, "2020-06-01", [-46.6], [-23.5])
+    manifest.plan([first])
+    _write(first[4]["png"], b"first")
+    to_render, to_link = manifest.plan([_task(shape_file, tmp_path, "2020-06-02", [-46.6], [-23.5])], force=True)
+    assert len(to_render) == 1 and to_link == []
@@ -0,0 +1,70 @@
+import aggregate_store
+import numpy
+import pandas
+import pytest
+import sys
+import timeseries_source
+import types
+from aggregate_store import AggregateStore
+from fs_handler import CASES_DTYPE
+from timeseries_source import DatabaseSource, HttpSource
+
+
+class _FakeResponse(object):
+    def __init__(self, status_code: int, text: str = ""):
+        self.status_code = status_code
+        self.text = text
+        self.headers = {}
+
+
+@pytest.fixture
+def fake_requests(monkeypatch):
+    # a stand-in for the requests module answering with the queued responses (or raising the queued exceptions)
+    module = types.SimpleNamespace(RequestException=IOError, responses=[], calls=0)
+
+    def get(url, headers=None, timeout=None):
+        module.calls += 1
+        response = module.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    module.get = get
+    monkeypatch.setitem(sys.modules, "requests", module)
+    return module
+
+
+@pytest.fixture
+def sleeps(monkeypatch) -> list:
+    slept = []
+    monkeypatch.setattr(timeseries_source.time, "sleep", slept.append)
+    return slept
+
+
+def test_http_retries_back_off_on_errors_and_status_codes(fake_requests, sleeps, tmp_path):
+    body = '[{"timeseries": {"6/1/20": {"confirmed": 5}}}]'
+    fake_requests.responses = [IOError("down"), _FakeResponse(503), _FakeResponse(200, body)]
+    source = HttpSource("http://example.invalid", str(tmp_path), 1, 3)
+    assert source.get_series() == {"2020-06-01 00:00:00": 5}
+    assert sleeps == [1, 2]
+
+
+def test_http_does_not_sleep_after_the_last_attempt(fake_requests, sleeps, tmp_path):
+    fake_requests.responses = [_FakeResponse(500), IOError("down")]
+    with pytest.raises(RuntimeError):
+        HttpSource("http://example.invalid", str(tmp_path), 1, 2).get_series()
+    assert fake_requests.calls == 2
+    assert sleeps == [1]
+
+
+class _SeriesDao(object):
+    def get_cases_series_by_region(self, level, aggregates=None):
+        return pandas.DataFrame({"idRegion": [1, 1], "entranceDate": pandas.to_datetime(["2020-06-01", "2020-06-02"]),
+                                 "cases": [3, 4]})
+
+
+def test_database_series_starts_at_the_baseline(monkeypatch, tmp_path):
+    monkeypatch.setattr(aggregate_store, "AGGREGATES_PATH", str(tmp_path))
+    assert DatabaseSource(_SeriesDao(), 1).get_series() == {"2020-06-01 00:00:00": 3, "2020-06-02 00:00:00": 7}
+    AggregateStore().set_baseline(numpy.array([(1, 1, 1, 100), (1, 2, 2, 20)], dtype=CASES_DTYPE))
+    assert DatabaseSource(_SeriesDao(), 1).get_series() == {"2020-06-01 00:00:00": 123, "2020-06-02 00:00:00": 127}
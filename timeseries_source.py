@@ -0,0 +1,120 @@
+import hashlib
+import json
+import logging
+import os
+import time
+from config import PREDICTION
+from lstm_dao import LstmDao
+from util import atomic_write, jhustr_to_mdbstr, time_to_mdbstr
+
+
+def _jhu_to_series(jhu_data: list) -> dict:
+    return {jhustr_to_mdbstr(k): v.get("confirmed", 0) for k, v in jhu_data[0].get("timeseries", {}).items()}
+
+
+def series_fingerprint(series: dict) -> str:
+    return hashlib.sha1(json.dumps(series, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class TimeSeriesSource(object):
+    # a source of the national cumulative cases series, as a {entranceDate: cases} dict ordered by date
+
+    def get_series(self) -> dict:
+        raise NotImplementedError
+
+
+class HttpSource(TimeSeriesSource):
+    # the JHU time series endpoint behind an on-disk cache revalidated with ETag / Last-Modified. When the endpoint
+    #  cannot be reached after the configured retries the cached response is used.
+
+    def __init__(self, url: str = None, cache_path: str = None, timeout: float = None, retries: int = None):
+        self._url: str = url if url else PREDICTION.get("url")
+        self._cache_filename: str = os.path.join(cache_path if cache_path else PREDICTION.get("http_cache_path"),
+                                                 f"{hashlib.sha1(self._url.encode('utf-8')).hexdigest()}.json")
+        self._timeout: float = timeout if timeout else PREDICTION.get("http_timeout")
+        self._retries: int = retries if retries else PREDICTION.get("http_retries")
+
+    def get_series(self) -> dict:
+        import requests
+        cached = self._load_cache()
+        headers = {}
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+        for attempt in range(self._retries):
+            if attempt:
+                # exponential backoff before every retry, whether the last attempt raised or returned an error status
+                time.sleep(2 ** (attempt - 1))
+            try:
+                response = requests.get(self._url, headers=headers, timeout=self._timeout)
+            except requests.RequestException as error:
+                logging.warning(f"Request to {self._url} failed ({error}), attempt {attempt + 1} of {self._retries}.")
+                continue
+            if response.status_code == 304 and cached.get("body"):
+                logging.info(f"Time series at {self._url} not modified; using the cached copy.")
+                return _jhu_to_series(json.loads(cached["body"]))
+            if response.status_code == 200:
+                self._save_cache({"etag": response.headers.get("ETag"),
+                                  "last_modified": response.headers.get("Last-Modified"),
+                                  "body": response.text})
+                return _jhu_to_series(json.loads(response.text))
+            logging.warning(f"Request to {self._url} returned {response.status_code}, attempt {attempt + 1} of "
+                            f"{self._retries}.")
+        if cached.get("body"):
+            logging.warning(f"Using the cached copy of {self._url}.")
+            return _jhu_to_series(json.loads(cached["body"]))
+        raise RuntimeError(f"Could not retrieve the time series from {self._url}.")
+
+    def _load_cache(self) -> dict:
+        try:
+            with open(self._cache_filename) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_cache(self, cache: dict):
+        atomic_write(self._cache_filename, lambda f: json.dump(cache, f), "w")
+
+
+class FileSource(TimeSeriesSource):
+    # a local copy of a JHU endpoint response, for offline runs and tests
+
+    def __init__(self, filename: str = None):
+        self._filename: str = filename if filename else PREDICTION.get("fixture_file")
+
+    def get_series(self) -> dict:
+        with open(self._filename) as f:
+            return _jhu_to_series(json.load(f))
+
+
+class DatabaseSource(TimeSeriesSource):
+    # the national series derived from our own covid_cases_history: the cumulative sum of the daily new cases on top of
+    #  the cumulative cases of the baseline file, which the history table does not hold. Without a recorded baseline
+    #  (histories ingested before it was kept) the series counts the cases since the ingestion started.
+
+    def __init__(self, db_handler: LstmDao, id_country: int = None):
+        self._db_handler: LstmDao = db_handler
+        self._id_country: int = id_country if id_country else PREDICTION.get("idCountry")
+
+    def get_series(self) -> dict:
+        from aggregate_store import AggregateStore
+        aggregates = AggregateStore()
+        baseline = aggregates.baseline("country").get(self._id_country)
+        if baseline is None:
+            logging.warning("No baseline cases recorded; the series starts at 0 on the first ingested day.")
+        series = self._db_handler.get_cases_series_by_region("country", aggregates)
+        series = series[series["idRegion"] == self._id_country]
+        return {time_to_mdbstr(d.to_pydatetime()): int(c)
+                for d, c in zip(series["entranceDate"], series["cases"].cumsum() + (baseline or 0))}
+
+
+def get_source(name: str = None, db_handler: LstmDao = None) -> TimeSeriesSource:
+    name = name if name else PREDICTION.get("source")
+    if name == "http":
+        return HttpSource()
+    if name == "file":
+        return FileSource()
+    if name == "database":
+        return DatabaseSource(db_handler)
+    raise ValueError(f"Unknown time series source '{name}'. Expected one of ['http', 'file', 'database'].")
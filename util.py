@@ -1,9 +1,7 @@
 import config
-import logging
+import os
 from datetime import datetime
 
-logging.basicConfig(level=config.LOG_LEVEL)
-
 
 def str_to_time(str_time: str, time_pattern: str):
     return datetime.strptime(str_time, time_pattern)
@@ -34,3 +32,19 @@ def jhustr_to_mdbstr(str_date: str) -> str:
         str_to_time(str_date, config.PREDICTION.get("jhu_date_pattern")),
         config.MARIADB_DATETIME_PATTERN
     )
+
+
+def atomic_write(filename: str, writer, mode: str = "wb"):
+    # writer(f) fills a temporary file next to `filename`, which then replaces it in one rename, so a concurrent reader
+    #  never sees a partially written file
+    if os.path.dirname(filename):
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+    tmp_filename = f"{filename}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_filename, mode) as f:
+            writer(f)
+        os.replace(tmp_filename, filename)
+    except BaseException:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+        raise